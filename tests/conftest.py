@@ -0,0 +1,68 @@
+import importlib.util
+import sys
+import unittest.mock
+
+import orjson
+import pytest
+
+# Mock Adafruit_DHT to disable hardware dependency in tests. The patch is
+# started before collection so every test module imports against it once.
+# It is skipped when the real package is installed, so the CI smoke test
+# imports the module that ships.
+_mock_dht = None
+
+
+def pytest_configure(config):
+    global _mock_dht
+    if importlib.util.find_spec("Adafruit_DHT") is None:
+        _mock_dht = unittest.mock.patch.dict(
+            sys.modules, {"Adafruit_DHT": unittest.mock.MagicMock()}
+        )
+        _mock_dht.start()
+
+
+def pytest_unconfigure(config):
+    global _mock_dht
+    if _mock_dht is not None:
+        _mock_dht.stop()
+        _mock_dht = None
+
+
+@pytest.fixture
+def thermostat_config(tmp_path):
+    """Thermostat config with MQTT enabled and state kept under tmp_path."""
+    return {
+        "host": "192.168.1.100",
+        "desired_temperature": 24.0,
+        "state_file": str(tmp_path / "state.json"),
+        "cooldown_minutes": 15,
+        "mqtt": {
+            "enabled": True,
+            "broker": "localhost",
+            "port": 1883,
+            "topic": "thermostat/temperature",
+        },
+    }
+
+
+@pytest.fixture
+def thermostat(thermostat_config):
+    """VirtualThermostat built from thermostat_config."""
+    from virtual_thermostat.cli import VirtualThermostat
+
+    return VirtualThermostat(thermostat_config)
+
+
+@pytest.fixture
+def sheets_logger(tmp_path, thermostat_config):
+    """SheetsLogger over thermostat_config with a mocked worksheet."""
+    from virtual_thermostat.sheets_logger import SheetsLogger
+
+    thermostat_config["google_sheets"] = {"enabled": True}
+    config_file = tmp_path / "config.json"
+    config_file.write_bytes(orjson.dumps(thermostat_config))
+
+    with unittest.mock.patch.object(SheetsLogger, "_setup_sheets_connection"):
+        sheets_logger = SheetsLogger(str(config_file))
+    sheets_logger.worksheet = unittest.mock.MagicMock()
+    return sheets_logger
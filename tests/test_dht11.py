@@ -1,11 +1,7 @@
 import pytest
 import unittest.mock
 
-# Mock Adafruit_DHT to disable hardware dependency in tests
-with unittest.mock.patch.dict(
-    "sys.modules", {"Adafruit_DHT": unittest.mock.MagicMock()}
-):
-    from virtual_thermostat.dht11 import DHT11Sensor
+from virtual_thermostat.dht11 import DHT11Sensor
 
 
 def test_dht11_sensor_initialization():
@@ -59,3 +55,52 @@ def test_mqtt_config():
     result = sensor.publish_mqtt(25.0, 60.0)
     # Should return False due to connection error, but not crash
     assert isinstance(result, bool)
+
+
+@unittest.mock.patch("virtual_thermostat.dht11.mqtt")
+def test_mqtt_client_reused(mock_mqtt):
+    """Test that one MQTT connection is kept across publishes."""
+    mock_mqtt.MQTT_ERR_SUCCESS = 0
+    client = mock_mqtt.Client.return_value
+    client.publish.return_value.rc = 0
+
+    sensor = DHT11Sensor(pin=4, mqtt_broker="localhost")
+    assert sensor.publish_mqtt(25.0, 60.0) is True
+    assert sensor.publish_mqtt(25.5, 61.0) is True
+
+    mock_mqtt.Client.assert_called_once()
+    client.connect.assert_called_once_with("localhost", 1883)
+    assert client.publish.call_count == 2
+
+    sensor.close()
+    client.disconnect.assert_called_once()
+    client.loop_stop.assert_called_once()
+
+
+@unittest.mock.patch("virtual_thermostat.dht11.time")
+def test_run_continuous_keeps_fixed_schedule(mock_time):
+    """Test that the time spent reading is not added to the interval."""
+    mock_time.time.return_value = 0
+    mock_time.monotonic.side_effect = [100.0, 100.4, 112.5]
+    mock_time.sleep.side_effect = [None, KeyboardInterrupt]
+
+    sensor = DHT11Sensor(pin=4, mqtt_broker="localhost")
+    with unittest.mock.patch.object(sensor, "publish_mqtt"):
+        sensor.run_continuous(10, simulate=True)
+
+    sleeps = [c.args[0] for c in mock_time.sleep.call_args_list]
+    assert sleeps == [pytest.approx(9.6), pytest.approx(7.5)]
+
+
+def test_hardware_reads_are_rate_limited():
+    """Test that back-to-back hardware reads reuse the last reading."""
+    sensor = DHT11Sensor(pin=4)
+    with unittest.mock.patch("virtual_thermostat.dht11.Adafruit_DHT") as mock_dht:
+        mock_dht.read_retry.return_value = (45.0, 22.0)
+        assert sensor._read_hardware() == (22.0, 45.0)
+        assert sensor._read_hardware() == (22.0, 45.0)
+        mock_dht.read_retry.assert_called_once()
+
+        sensor._last_reading_time -= 2
+        sensor._read_hardware()
+        assert mock_dht.read_retry.call_count == 2
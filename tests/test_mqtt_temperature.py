@@ -1,176 +1,421 @@
+import asyncio
 import json
-import tempfile
+import logging
 import os
+import threading
+import time
 from unittest.mock import MagicMock, patch, AsyncMock
 import pytest
-import unittest.mock
+from kasa import KasaException
 
-# Mock Adafruit_DHT to disable hardware dependency in tests
-with unittest.mock.patch.dict(
-    "sys.modules", {"Adafruit_DHT": unittest.mock.MagicMock()}
-):
-    from virtual_thermostat.cli import VirtualThermostat
+from virtual_thermostat import cli, connections
+from virtual_thermostat.cli import VirtualThermostat
 
 
-def test_virtual_thermostat_init():
+def test_virtual_thermostat_init(tmp_path, thermostat_config):
     """Test VirtualThermostat initialization."""
-    config_data = {
-        "host": "192.168.1.100",
-        "desired_temperature": 24.0,
-        "state_file": "/tmp/test_state.json",
-        "cooldown_minutes": 15,
-        "mqtt": {
-            "enabled": True,
-            "broker": "localhost",
-            "port": 1883,
-            "topic": "thermostat/temperature",
-        },
-    }
-
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as config_file:
-        json.dump(config_data, config_file)
-        config_file_path = config_file.name
-
-    try:
-        thermostat = VirtualThermostat(config_file_path)
-        assert thermostat.config["host"] == "192.168.1.100"
-        assert thermostat.config["desired_temperature"] == 24.0
-        assert thermostat.config["mqtt"]["enabled"] is True
-        assert thermostat.state["last_ac_state"] is False
-    finally:
-        os.unlink(config_file_path)
-
-
-def test_read_temperature_mqtt_disabled():
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps(thermostat_config))
+
+    thermostat = VirtualThermostat(str(config_file))
+    assert thermostat.config["host"] == "192.168.1.100"
+    assert thermostat.config["desired_temperature"] == 24.0
+    assert thermostat.config["mqtt"]["enabled"] is True
+    assert thermostat.state["last_ac_state"] is False
+
+
+def test_read_temperature_mqtt_disabled(thermostat_config):
     """Test that MQTT disabled raises exception."""
-    config_data = {
-        "host": "192.168.1.100",
-        "desired_temperature": 24.0,
-        "state_file": "/tmp/test_state.json",
-        "mqtt": {"enabled": False},
-    }
-
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as config_file:
-        json.dump(config_data, config_file)
-        config_file_path = config_file.name
-
-    try:
-        thermostat = VirtualThermostat(config_file_path)
-        with pytest.raises(Exception):  # Should raise ClickException
-            thermostat._read_temperature()
-    finally:
-        os.unlink(config_file_path)
-
-
-def test_read_temperature_mqtt_failure():
+    thermostat_config["mqtt"] = {"enabled": False}
+
+    thermostat = VirtualThermostat(thermostat_config)
+    with pytest.raises(Exception):  # Should raise ClickException
+        asyncio.run(thermostat._read_temperature())
+
+
+def test_read_temperature_mqtt_failure(thermostat_config):
     """Test that MQTT connection failure returns None."""
-    config_data = {
-        "host": "192.168.1.100",
-        "desired_temperature": 24.0,
-        "state_file": "/tmp/test_state.json",
-        "mqtt": {
-            "enabled": True,
-            "broker": "nonexistent.broker",
-            "port": 1883,
-            "topic": "thermostat/temperature",
-        },
-    }
-
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as config_file:
-        json.dump(config_data, config_file)
-        config_file_path = config_file.name
-
-    try:
-        thermostat = VirtualThermostat(config_file_path)
-        temperature = thermostat._read_temperature()
-        assert temperature is None
-    finally:
-        os.unlink(config_file_path)
-
-
-@patch("virtual_thermostat.cli.subscribe")
-def test_read_temperature_mqtt_success(mock_subscribe):
+    thermostat_config["mqtt"]["broker"] = "nonexistent.broker"
+
+    thermostat = VirtualThermostat(thermostat_config)
+    temperature = asyncio.run(thermostat._read_temperature())
+    assert temperature is None
+
+
+@patch.object(connections, "mqtt")
+def test_read_temperature_mqtt_success(mock_mqtt, thermostat):
     """Test successful MQTT temperature reading."""
-    # Mock successful MQTT message
-    mock_msg = MagicMock()
-    mock_msg.payload.decode.return_value = "25"
-    mock_subscribe.simple.return_value = mock_msg
-
-    config_data = {
-        "host": "192.168.1.100",
-        "desired_temperature": 24.0,
-        "state_file": "/tmp/test_state.json",
-        "mqtt": {
-            "enabled": True,
-            "broker": "localhost",
-            "port": 1883,
-            "topic": "thermostat/temperature",
-        },
-    }
-
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as config_file:
-        json.dump(config_data, config_file)
-        config_file_path = config_file.name
-
-    try:
-        thermostat = VirtualThermostat(config_file_path)
-        with patch.object(thermostat, "_get_temperature_from_mqtt", return_value=25):
-            temperature = thermostat._read_temperature()
-            assert temperature == 25
-    finally:
-        os.unlink(config_file_path)
-
-
-def test_thermostat_run_with_mock():
+    with patch.object(thermostat, "_get_temperature_from_mqtt", return_value=25):
+        temperature = asyncio.run(thermostat._read_temperature())
+        assert temperature == 25
+
+
+def test_thermostat_run_with_mock(thermostat_config):
     """Test full thermostat run with mocked AC control."""
-    import asyncio
-
-    config_data = {
-        "host": "192.168.1.100",
-        "desired_temperature": 22.0,  # Low temp to trigger AC
-        "state_file": "/tmp/test_state.json",
-        "cooldown_minutes": 0,  # No cooldown for testing
-        "mqtt": {
-            "enabled": True,
-            "broker": "localhost",
-            "port": 1883,
-            "topic": "thermostat/temperature",
-        },
-    }
-
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as config_file:
-        json.dump(config_data, config_file)
-        config_file_path = config_file.name
-
-    try:
-        thermostat = VirtualThermostat(config_file_path)
-
-        # Mock both temperature reading and AC control
-        with patch.object(
-            thermostat, "_read_temperature", return_value=25
-        ), patch.object(
-            thermostat, "_control_ac", new_callable=AsyncMock, return_value=True
-        ) as mock_control_ac:
-
-            asyncio.run(thermostat.run_once())
-
-            # Should have called _control_ac with True since temp (25) > desired (22)
-            mock_control_ac.assert_called_once_with(True)
-
-    finally:
-        os.unlink(config_file_path)
-        # Clean up state file if created
-        try:
-            os.unlink("/tmp/test_state.json")
-        except FileNotFoundError:
-            pass
+    thermostat_config["desired_temperature"] = 22.0  # Low temp to trigger AC
+    thermostat_config["cooldown_minutes"] = 0  # No cooldown for testing
+
+    thermostat = VirtualThermostat(thermostat_config)
+
+    # Mock both temperature reading and AC control
+    with patch.object(thermostat, "_read_temperature", return_value=25), patch.object(
+        thermostat, "_control_ac", new_callable=AsyncMock, return_value=True
+    ) as mock_control_ac:
+
+        asyncio.run(thermostat.run_once())
+
+        # Should have called _control_ac with True since temp (25) > desired (22)
+        # The plug could not be reached, so its state is not known
+        mock_control_ac.assert_called_once_with(True, expected_current=None)
+
+
+@patch.object(connections, "mqtt")
+def test_read_temperature_uses_cached_mqtt_message(mock_mqtt, thermostat):
+    """Test that MQTT messages are cached by the persistent subscriber."""
+    msg = MagicMock()
+    msg.payload = b'{"temperature": 26.4, "humidity": 40.0}'
+    thermostat._get_mqtt()._on_message(None, None, msg)
+
+    assert asyncio.run(thermostat._read_temperature()) == 26
+    assert asyncio.run(thermostat._read_temperature()) == 26
+    # A single client is created and connected for both reads
+    mock_mqtt.Client.assert_called_once()
+    mock_mqtt.Client.return_value.loop_start.assert_called_once()
+
+    asyncio.run(thermostat.close())
+    mock_mqtt.Client.return_value.loop_stop.assert_called_once()
+    mock_mqtt.Client.return_value.disconnect.assert_called_once()
+
+
+@patch.object(connections, "mqtt")
+def test_read_temperature_wakes_on_first_mqtt_message(mock_mqtt, thermostat):
+    """Test that a waiting read is woken up by a message from the MQTT thread."""
+    msg = MagicMock()
+    msg.payload = b"23.5"
+
+    async def run():
+        read = asyncio.ensure_future(thermostat._read_temperature())
+        await asyncio.sleep(0)
+        threading.Thread(
+            target=thermostat._get_mqtt()._on_message, args=(None, None, msg)
+        ).start()
+        return await asyncio.wait_for(read, 0.5)
+
+    assert asyncio.run(run()) == 23
+
+
+@patch.object(connections, "mqtt")
+def test_mqtt_subscriber_restarts_when_settings_change(mock_mqtt, thermostat):
+    """Test that a reloaded broker or topic replaces the running subscriber."""
+    msg = MagicMock()
+    msg.payload = b"23.5"
+    thermostat._get_mqtt()._on_message(None, None, msg)
+    assert asyncio.run(thermostat._read_temperature()) == 23
+
+    config = dict(thermostat.config)
+    config["mqtt"] = dict(config["mqtt"], topic="other/temperature")
+    thermostat._apply_config(config)
+
+    subscriber = thermostat._get_mqtt()
+    assert subscriber.topic == "other/temperature"
+    mock_mqtt.Client.return_value.disconnect.assert_called_once()
+    subscriber._on_message(None, None, msg)
+    assert asyncio.run(thermostat._read_temperature()) == 23
+    assert mock_mqtt.Client.call_count == 2
+
+
+def test_stale_retained_mqtt_message_is_ignored(thermostat):
+    """Test that a retained reading is aged from its publish timestamp."""
+    from datetime import datetime, timedelta
+
+    published = datetime.now() - timedelta(minutes=10)
+    msg = MagicMock()
+    msg.retain = True
+    msg.payload = json.dumps(
+        {"temperature": 26.4, "timestamp": published.isoformat()}
+    ).encode()
+    thermostat._get_mqtt()._on_message(None, None, msg)
+
+    with patch.object(connections, "mqtt"):
+        assert asyncio.run(thermostat._read_temperature()) is None
+
+    msg.retain = False
+    thermostat._get_mqtt()._on_message(None, None, msg)
+    with patch.object(connections, "mqtt"):
+        assert asyncio.run(thermostat._read_temperature()) == 26
+
+
+def test_save_state_batches_writes(tmp_path, thermostat):
+    """Test that routine state saves are deferred and written atomically."""
+    state_file = tmp_path / "state.json"
+    thermostat._state_batching = True
+    # Batching settings are picked up when the config is reloaded
+    thermostat._apply_config(
+        dict(thermostat.config, state_save_ticks=2, state_write_interval=0)
+    )
+
+    thermostat.state["last_run"] = "2025-01-01T00:00:00"
+    thermostat._save_state()
+    assert not state_file.exists()
+
+    thermostat.state["last_run"] = "2025-01-01T00:01:00"
+    thermostat._save_state()
+    assert json.loads(state_file.read_text())["last_run"] == "2025-01-01T00:01:00"
+    assert not (tmp_path / "state.json.tmp").exists()
+
+    thermostat.state["last_ac_state"] = True
+    thermostat._save_state(force=True)
+    assert json.loads(state_file.read_text())["last_ac_state"] is True
+
+
+def test_save_state_throttles_timestamp_only_changes(tmp_path, thermostat):
+    """Test that a state differing only in last_run is written sparingly."""
+    state_file = tmp_path / "state.json"
+    thermostat._state_batching = True
+    thermostat.settings.state_save_ticks = 1
+
+    thermostat.state["last_run"] = "2025-01-01T00:00:00"
+    thermostat._save_state()
+    thermostat.state["last_run"] = "2025-01-01T00:01:00"
+    thermostat._save_state()
+    assert json.loads(state_file.read_text())["last_run"] == "2025-01-01T00:00:00"
+
+    thermostat._state_written -= 300
+    thermostat._save_state()
+    assert json.loads(state_file.read_text())["last_run"] == "2025-01-01T00:01:00"
+
+    thermostat.state["last_temperature"] = 25
+    thermostat._save_state()
+    assert json.loads(state_file.read_text())["last_temperature"] == 25
+
+
+def test_save_state_renders_last_run_lazily(thermostat):
+    """Test that last_run is only rendered for saves that are written."""
+    from datetime import datetime
+
+    thermostat._state_batching = True
+    thermostat.settings.state_save_ticks = 1
+    thermostat._last_run = 1_700_000_000
+    thermostat._save_state()
+    rendered = datetime.fromtimestamp(1_700_000_000).isoformat()
+    assert thermostat.state["last_run"] == rendered
+
+    thermostat._last_run = 1_700_000_060
+    thermostat._save_state()
+    assert thermostat.state["last_run"] == rendered
+
+
+def test_control_ac_trusts_expected_state(thermostat):
+    """Test that a plug state read this cycle is not queried again."""
+    plug = AsyncMock()
+    thermostat._plug.plug = plug
+    thermostat._plug._key = ("192.168.1.100", None, None)
+
+    assert asyncio.run(thermostat._control_ac(True, expected_current=True)) is True
+    plug.turn_on.assert_not_called()
+
+    assert asyncio.run(thermostat._control_ac(True, expected_current=False)) is True
+    plug.update.assert_not_called()
+    plug.turn_on.assert_called_once()
+
+
+def test_cooldown_from_persisted_timestamp(tmp_path, thermostat_config):
+    """Test that the cooldown survives restarts through the state file."""
+    from datetime import datetime, timedelta
+
+    state_file = tmp_path / "state.json"
+    state_file.write_text(
+        json.dumps(
+            {
+                "last_ac_state": True,
+                "last_ac_change": (datetime.now() - timedelta(minutes=5)).isoformat(),
+            }
+        )
+    )
+
+    thermostat = VirtualThermostat(thermostat_config)
+    assert thermostat._is_within_cooldown() is True
+
+    thermostat._apply_config(dict(thermostat.config, cooldown_minutes=4))
+    assert thermostat._is_within_cooldown() is False
+
+
+def test_failed_ac_switch_restores_state(tmp_path, thermostat_config):
+    """Test that the optimistic AC state and cooldown are reverted on failure."""
+    thermostat_config["desired_temperature"] = 22.0
+    thermostat = VirtualThermostat(thermostat_config)
+
+    async def run():
+        await thermostat.run_once()
+        assert thermostat.state["last_ac_state"] is True
+        assert thermostat._is_within_cooldown()
+        await thermostat.close()
+
+    with patch.object(thermostat, "_read_temperature", return_value=25), patch.object(
+        thermostat, "_control_ac", new_callable=AsyncMock, return_value=None
+    ):
+        asyncio.run(run())
+
+    # The failed switch does not hold the AC in the 15 minute cooldown
+    assert thermostat.state["last_ac_state"] is False
+    assert thermostat.state["last_ac_change"] is None
+    assert not thermostat._is_within_cooldown()
+    saved = json.loads((tmp_path / "state.json").read_text())
+    assert saved["last_ac_state"] is False
+    assert saved["last_ac_change"] is None
+
+
+def test_next_interval_adapts_to_temperature(thermostat_config):
+    """Test that the daemon polls faster near the desired temperature."""
+    thermostat_config.update(interval_fast=10, interval_slow=300)
+    thermostat = VirtualThermostat(thermostat_config)
+
+    assert thermostat._next_interval(60) == 60
+
+    thermostat.state["last_temperature"] = 25
+    assert thermostat._next_interval(60) == 10
+
+    thermostat.state["last_temperature"] = 30
+    assert thermostat._next_interval(60) == 300
+
+    # Two minutes into a 15 minute cooldown, capped by interval_slow
+    thermostat._last_ac_change_mono = time.monotonic() - 120
+    assert thermostat._next_interval(60) == 300
+    thermostat._last_ac_change_mono = time.monotonic() - 14 * 60
+    assert 55 <= thermostat._next_interval(60) <= 60
+
+
+def test_refresh_plug_reconnects_after_error(thermostat):
+    """Test that a failing cached plug is discarded and reconnected once."""
+    stale = AsyncMock()
+    stale.update.side_effect = KasaException("session expired")
+    fresh = AsyncMock()
+
+    with patch.object(connections, "SmartPlug") as mock_smart_plug:
+        mock_smart_plug.side_effect = [stale, fresh]
+        plug = asyncio.run(thermostat._refresh_plug())
+
+    assert plug is fresh
+    assert mock_smart_plug.call_count == 2
+    mock_smart_plug.assert_called_with("192.168.1.100")
+    plug.update.assert_called_once()
+
+
+def test_run_once_reloads_config_only_when_modified(tmp_path, thermostat_config):
+    """Test that the config file is parsed again only after it changes."""
+    thermostat_config["enabled"] = False
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps(thermostat_config))
+    thermostat = VirtualThermostat(str(config_file))
+
+    with patch.object(thermostat, "_apply_config") as mock_apply:
+        asyncio.run(thermostat.run_once())
+        mock_apply.assert_not_called()
+
+        mtime = config_file.stat().st_mtime_ns + 1_000_000_000
+        os.utime(config_file, ns=(mtime, mtime))
+        asyncio.run(thermostat.run_once())
+        mock_apply.assert_called_once()
+
+
+def test_run_once_skips_polling_during_cooldown(thermostat_config):
+    """Test that the plug and sensor are not queried during the cooldown."""
+    thermostat_config["skip_polling_during_cooldown"] = True
+    thermostat = VirtualThermostat(thermostat_config)
+    thermostat._last_ac_change_mono = time.monotonic()
+
+    with patch.object(thermostat, "_refresh_plug") as mock_refresh, patch.object(
+        thermostat, "_read_temperature"
+    ) as mock_read:
+        asyncio.run(thermostat.run_once())
+
+    mock_refresh.assert_not_called()
+    mock_read.assert_not_called()
+    assert thermostat.state["last_run"] is not None
+
+
+def test_read_plug_state_reuses_recent_state(thermostat_config):
+    """Test that the plug is not queried again within the state TTL."""
+    thermostat_config["plug_state_ttl_seconds"] = 30
+    thermostat = VirtualThermostat(thermostat_config)
+    plug = AsyncMock()
+    plug.is_on = True
+
+    with patch.object(thermostat, "_refresh_plug", return_value=plug) as mock_refresh:
+        assert asyncio.run(thermostat._read_plug_state()) is True
+        assert asyncio.run(thermostat._read_plug_state()) is True
+        mock_refresh.assert_called_once()
+
+        # A commanded change updates the cached state
+        thermostat._remember_plug_state(False)
+        assert asyncio.run(thermostat._read_plug_state()) is False
+        mock_refresh.assert_called_once()
+
+
+@pytest.mark.parametrize("content", [b"", b"{not json", b"null"])
+def test_load_state_falls_back_to_default(tmp_path, thermostat_config, content):
+    """Test that an empty or invalid state file yields the default state."""
+    (tmp_path / "state.json").write_bytes(content)
+
+    thermostat = VirtualThermostat(thermostat_config)
+    assert thermostat.state == cli.DEFAULT_STATE
+    assert thermostat.state is not cli.DEFAULT_STATE
+
+
+def test_run_daemon_saves_state_when_cancelled(thermostat):
+    """Test that cancelling the daemon still writes out pending state."""
+
+    async def run():
+        with patch.object(thermostat, "run_once", new_callable=AsyncMock):
+            task = asyncio.ensure_future(thermostat.run_daemon(60))
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    thermostat.state["last_temperature"] = 25
+    asyncio.run(run())
+    state = json.loads(open(thermostat.settings.state_file).read())
+    assert state["last_temperature"] == 25
+
+
+def test_buffered_log_handler_reports_write_errors():
+    """Test that a failed buffered write goes to handleError, not the caller."""
+    stream = MagicMock()
+    stream.write.side_effect = OSError("disk full")
+    target = logging.StreamHandler(stream)
+    handler = cli.BufferedLogHandler(64, target=target)
+    handler.handle(logging.makeLogRecord({"msg": "cycle", "levelno": logging.INFO}))
+
+    with patch.object(target, "handleError") as mock_handle_error:
+        handler.close()
+    mock_handle_error.assert_called_once()
+    assert handler.buffer == []
+
+
+def test_run_daemon_keeps_a_fixed_schedule(thermostat):
+    """Test that cycles start on a fixed grid regardless of their run time."""
+    clock = [100.0]
+    durations = [0.4, 65.0, 1.0]
+    sleeps = []
+
+    async def run_once():
+        if not durations:
+            raise asyncio.CancelledError
+        clock[0] += durations.pop(0)
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        clock[0] += delay
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with patch.object(loop, "time", lambda: clock[0]), patch.object(
+            thermostat, "run_once", run_once
+        ), patch.object(cli.asyncio, "sleep", sleep):
+            await thermostat.run_daemon(60)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run())
+    # The slow second cycle skips the missed tick instead of running late
+    assert sleeps == [pytest.approx(59.6), pytest.approx(55.0), pytest.approx(59.0)]
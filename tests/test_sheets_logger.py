@@ -0,0 +1,228 @@
+import asyncio
+import os
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from virtual_thermostat import connections
+from virtual_thermostat import sheets_logger as sheets
+
+
+def test_upload_batches_rows(sheets_logger):
+    """Rows are appended in a single request once a batch is full."""
+    sheets_logger.config["google_sheets"]["batch_size"] = 2
+    worksheet = sheets_logger.worksheet
+
+    assert sheets_logger._upload_to_sheets()
+    worksheet.append_rows.assert_not_called()
+
+    assert sheets_logger._upload_to_sheets()
+    worksheet.append_rows.assert_called_once()
+    assert len(worksheet.append_rows.call_args[0][0]) == 2
+    assert sheets_logger._pending_rows == []
+
+
+def test_close_flushes_pending_rows(sheets_logger):
+    """Rows waiting for a full batch are uploaded on close."""
+    sheets_logger.config["google_sheets"]["batch_size"] = 10
+    sheets_logger._upload_to_sheets()
+
+    asyncio.run(sheets_logger.close())
+    sheets_logger.worksheet.append_rows.assert_called_once()
+    assert sheets_logger._pending_rows == []
+
+
+@patch.object(connections, "mqtt")
+def test_read_sensor_data_uses_persistent_mqtt_client(mock_mqtt, sheets_logger):
+    """Readings come from one long-lived MQTT subscriber."""
+    msg = MagicMock()
+    msg.payload = b'{"temperature": 26.4, "humidity": 40.0}'
+    sheets_logger._get_mqtt()._on_message(None, None, msg)
+
+    with patch.object(sheets_logger, "_get_outside_temperature", return_value=None):
+        assert asyncio.run(sheets_logger._read_sensor_data())
+        assert asyncio.run(sheets_logger._read_sensor_data())
+    assert sheets_logger.current_data["temperature"] == 26.4
+    assert sheets_logger.current_data["humidity"] == 40.0
+    mock_mqtt.Client.assert_called_once()
+
+    asyncio.run(sheets_logger.close())
+    mock_mqtt.Client.return_value.disconnect.assert_called_once()
+    mock_mqtt.Client.return_value.loop_stop.assert_called_once()
+
+
+@patch.object(connections, "mqtt")
+def test_mqtt_subscriber_restarts_when_settings_change(mock_mqtt, sheets_logger):
+    """A reloaded broker replaces the running MQTT subscriber."""
+    first = sheets_logger._get_mqtt()
+    assert sheets_logger._get_mqtt() is first
+
+    sheets_logger.config["mqtt"]["broker"] = "broker.lan"
+    subscriber = sheets_logger._get_mqtt()
+    assert subscriber is not first
+    assert subscriber.broker == "broker.lan"
+
+
+def test_outside_temperature_is_cached(sheets_logger):
+    """wttr.in is only queried again once the cached value expires."""
+    fetch = AsyncMock(side_effect=[15.0, None])
+    with patch.object(sheets_logger, "_fetch_outside_temperature", fetch):
+        assert asyncio.run(sheets_logger._get_outside_temperature()) == 15.0
+        assert asyncio.run(sheets_logger._get_outside_temperature()) == 15.0
+        assert fetch.call_count == 1
+
+        # A failed refetch keeps the last known value
+        sheets_logger._outside_temperature_time -= 3600
+        assert asyncio.run(sheets_logger._get_outside_temperature()) == 15.0
+        assert fetch.call_count == 2
+
+
+def test_state_file_parsed_only_when_modified(sheets_logger):
+    """The state file is parsed again only after it has been rewritten."""
+    state_file = Path(sheets_logger.config["state_file"])
+    state_file.write_bytes(b'{"last_ac_state": true}')
+
+    with patch.object(sheets.orjson, "loads", wraps=sheets.orjson.loads) as load:
+        assert asyncio.run(sheets_logger._read_state_data())
+        assert asyncio.run(sheets_logger._read_state_data())
+        assert load.call_count == 1
+
+        state_file.write_bytes(b'{"last_ac_state": false}')
+        st = state_file.stat()
+        os.utime(state_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        assert asyncio.run(sheets_logger._read_state_data())
+        assert load.call_count == 2
+    assert sheets_logger.state_data["last_ac_state"] is False
+
+
+def test_fetch_outside_temperature_parses_wttr(sheets_logger):
+    """The signed wttr.in reading is parsed from the raw response bytes."""
+    response = MagicMock()
+    response.read = AsyncMock(return_value="+15°C\n".encode())
+    sheets_logger._http = MagicMock()
+    sheets_logger._http.get.return_value.__aenter__.return_value = response
+
+    assert asyncio.run(sheets_logger._fetch_outside_temperature()) == 15.0
+
+
+def test_outside_temperature_backs_off_after_failures(sheets_logger):
+    """Failed wttr.in requests are retried after a growing delay."""
+    fetch = AsyncMock(return_value=None)
+    with patch.object(sheets_logger, "_fetch_outside_temperature", fetch):
+        assert asyncio.run(sheets_logger._get_outside_temperature()) is None
+        assert asyncio.run(sheets_logger._get_outside_temperature()) is None
+        assert fetch.call_count == 1
+        assert sheets_logger._outside_backoff == sheets.OUTSIDE_BACKOFF_MIN
+
+        sheets_logger._outside_retry_time -= sheets.OUTSIDE_BACKOFF_MIN
+        asyncio.run(sheets_logger._get_outside_temperature())
+        assert fetch.call_count == 2
+        assert sheets_logger._outside_backoff == 2 * sheets.OUTSIDE_BACKOFF_MIN
+
+
+def test_format_iso():
+    """ISO timestamps are shown in the sheet format, other text is kept."""
+    assert sheets._format_iso("2024-01-02T03:04:05Z") == "2024/01/02 03:04:05"
+    assert sheets._format_iso("2024-01-02T03:04:05.123456") == "2024/01/02 03:04:05"
+    assert sheets._format_iso("yesterday") == "yesterday"
+
+
+@patch.object(connections, "SmartPlug")
+def test_read_current_power_reuses_plug(mock_plug_cls, sheets_logger):
+    """The smart plug is created once and reused across cycles."""
+    plug = mock_plug_cls.return_value
+    plug.update = AsyncMock()
+    plug.is_on = True
+    plug.has_emeter = True
+    plug.emeter_realtime = {"power": 850.0}
+
+    assert asyncio.run(sheets_logger._read_current_power())
+    assert asyncio.run(sheets_logger._read_current_power())
+    assert sheets_logger.current_power == 850.0
+    mock_plug_cls.assert_called_once_with("192.168.1.100")
+
+    # A failed update drops the connection so the next cycle reconnects
+    plug.update.side_effect = OSError("unreachable")
+    assert not asyncio.run(sheets_logger._read_current_power())
+    assert sheets_logger._plug.plug is None
+
+
+def test_fetch_outside_temperature_rejects_unexpected_format(sheets_logger):
+    """A response without the Celsius suffix is not reported."""
+    response = MagicMock()
+    response.read = AsyncMock(return_value=b"Unknown location")
+    sheets_logger._http = MagicMock()
+    sheets_logger._http.get.return_value.__aenter__.return_value = response
+
+    assert asyncio.run(sheets_logger._fetch_outside_temperature()) is None
+
+
+def test_run_daemon_keeps_a_fixed_schedule(sheets_logger):
+    """Cycles start on a fixed grid regardless of how long each one takes."""
+    clock = [100.0]
+    durations = [0.4, 12.5, 1.0]
+    sleeps = []
+
+    async def run_once():
+        if not durations:
+            raise asyncio.CancelledError
+        clock[0] += durations.pop(0)
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        clock[0] += delay
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with patch.object(loop, "time", lambda: clock[0]), patch.object(
+            sheets_logger, "run_once", run_once
+        ), patch.object(sheets.asyncio, "sleep", sleep):
+            await sheets_logger.run_daemon(10)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run())
+    # The slow second cycle skips the missed tick instead of running late
+    assert sleeps == [pytest.approx(9.6), pytest.approx(7.5), pytest.approx(9.0)]
+
+
+@patch.object(connections, "mqtt")
+def test_read_sensor_data_ignores_stale_retained_message(mock_mqtt, sheets_logger):
+    """A retained reading published long ago is not uploaded as current."""
+    msg = MagicMock()
+    msg.retain = True
+    msg.payload = (
+        b'{"temperature": 26.4, "humidity": 40.0,'
+        b' "timestamp": "2020-01-01T00:00:00"}'
+    )
+    sheets_logger._get_mqtt()._on_message(None, None, msg)
+
+    with patch.object(sheets_logger, "_get_outside_temperature", return_value=None):
+        assert not asyncio.run(sheets_logger._read_sensor_data())
+    assert sheets_logger.current_data["temperature"] is None
+
+
+def test_failed_upload_is_retried_without_queueing_rows(sheets_logger):
+    """During an outage one row is kept per interval and retried later."""
+    worksheet = sheets_logger.worksheet
+    worksheet.append_rows.side_effect = OSError("unreachable")
+
+    assert not sheets_logger._upload_to_sheets()
+    # The interval counts as recorded, later cycles only retry the flush
+    assert not sheets_logger._should_upload(15)
+    assert not sheets_logger._flush_full_batch()
+    assert len(sheets_logger._pending_rows) == 1
+
+    worksheet.append_rows.side_effect = None
+    assert sheets_logger._flush_full_batch()
+    assert len(worksheet.append_rows.call_args[0][0]) == 1
+    assert sheets_logger._pending_rows == []
+
+
+@patch.object(sheets, "MAX_PENDING_ROWS", 2)
+def test_pending_rows_are_capped(sheets_logger):
+    """The oldest rows are dropped when uploads keep failing."""
+    sheets_logger.worksheet.append_rows.side_effect = OSError("unreachable")
+    for _ in range(3):
+        sheets_logger._upload_to_sheets()
+    assert len(sheets_logger._pending_rows) == 2
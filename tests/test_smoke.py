@@ -1,32 +1,27 @@
-import subprocess
-import sys
+import importlib
+
+from click.testing import CliRunner
 
 
 def test_cli_module_imports():
     """Test that the cli module can be imported without errors."""
-    result = subprocess.run(
-        [sys.executable, "-c", "import virtual_thermostat.cli"],
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 0
+    importlib.import_module("virtual_thermostat.cli")
 
 
 def test_ui_module_imports():
     """Test that the ui module can be imported without errors."""
-    result = subprocess.run(
-        [sys.executable, "-c", "import virtual_thermostat.ui"],
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 0
+    importlib.import_module("virtual_thermostat.ui")
 
 
 def test_dht11_module_imports():
     """Test that the dht11 module can be imported without errors."""
-    result = subprocess.run(
-        [sys.executable, "-c", "import virtual_thermostat.dht11"],
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 0
+    importlib.import_module("virtual_thermostat.dht11")
+
+
+def test_cli_help():
+    """Test that the cli entry point parses its options."""
+    from virtual_thermostat.cli import cli_main
+
+    result = CliRunner().invoke(cli_main, ["--help"])
+    assert result.exit_code == 0
+    assert "--daemon" in result.output
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from virtual_thermostat import ui
+
+
+def test_save_config_round_trip(tmp_path, thermostat_config):
+    """A saved config is read back and no temporary file is left behind."""
+    config_file = tmp_path / "config.json"
+
+    assert ui.save_config(thermostat_config, config_file)
+    assert ui.read_config(config_file) == thermostat_config
+    assert [p.name for p in tmp_path.iterdir()] == ["config.json"]
+
+
+def test_format_clock():
+    """The time of day is formatted once per second and reused."""
+    ui._format_clock.cache_clear()
+    expected = time.strftime("%H:%M:%S", time.localtime(1_700_000_000))
+    assert ui._format_clock(1_700_000_000) == expected
+    assert ui._format_clock(1_700_000_000) == expected
+    assert ui._format_clock.cache_info().hits == 1
+
+
+def test_save_state_failure(tmp_path):
+    """A state file that cannot be written is reported, not raised."""
+    assert not ui.save_state({"last_ac_state": True}, tmp_path / "missing" / "s.json")
+
+
+def test_back_to_back_saves_keep_the_latest(tmp_path, thermostat_config):
+    """The last of two overlapping saves is the one left in the file."""
+    config_file = tmp_path / "config.json"
+    older = dict(thermostat_config, desired_temperature=22.0)
+    newer = dict(thermostat_config, desired_temperature=26.0)
+
+    def save(config, path):
+        # Let the older save finish last if the writes were not serialized
+        if config is older:
+            time.sleep(0.05)
+        return ui.save_config(config, path)
+
+    async def run():
+        writer = ui.SerialWriter()
+        return await asyncio.gather(
+            writer.write(save, older, config_file),
+            writer.write(save, newer, config_file),
+        )
+
+    assert asyncio.run(run()) == [True, True]
+    assert ui.read_config(config_file)["desired_temperature"] == 26.0
+    assert [p.name for p in tmp_path.iterdir()] == ["config.json"]
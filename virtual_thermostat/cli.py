@@ -6,138 +6,333 @@ Supports web controller interface and cooldown functionality.
 """
 
 import asyncio
-import json
 import logging
-from datetime import datetime, timedelta
+import logging.handlers
+import os
+import time
+from datetime import datetime
 from pathlib import Path
 
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import click
-import paho.mqtt.subscribe as subscribe
-from kasa import SmartPlug
+import orjson
+from kasa import KasaException
+
+from virtual_thermostat.connections import MQTTSubscriber, PlugConnection
 
 logger = logging.getLogger("simple-thermostat")
 
+# State used when the state file is missing, empty or invalid
+DEFAULT_STATE = {"last_ac_state": False, "last_run": None, "last_ac_change": None}
+
+# State is written compactly, VTHERMOSTAT_PRETTY=1 indents it for debugging
+STATE_DUMP_OPTION = (
+    orjson.OPT_INDENT_2 if os.environ.get("VTHERMOSTAT_PRETTY") == "1" else 0
+)
+
+
+class BufferedLogHandler(logging.handlers.MemoryHandler):
+    """Buffer log records and write them to a stream handler in one write."""
+
+    def flush(self):
+        with self.lock:
+            if not self.buffer or self.target is None:
+                return
+            target = self.target
+            records = [
+                r for r in self.buffer if r.levelno >= target.level and target.filter(r)
+            ]
+            if records:
+                # Same as the target's emit, for all records at once
+                target.acquire()
+                try:
+                    target.stream.write(
+                        "".join(target.format(r) + target.terminator for r in records)
+                    )
+                    target.flush()
+                except Exception:
+                    target.handleError(records[-1])
+                finally:
+                    target.release()
+            self.buffer.clear()
+
+
+class ThermostatSettings:
+    """Config values used on every cycle, resolved once per config load."""
+
+    __slots__ = (
+        "host",
+        "desired_temperature",
+        "cooldown_minutes",
+        "state_file",
+        "kasa_username",
+        "kasa_password",
+        "enabled",
+        "mqtt_enabled",
+        "mqtt_broker",
+        "mqtt_port",
+        "mqtt_topic",
+        "mqtt_max_age",
+        "interval_fast",
+        "interval_slow",
+        "hysteresis",
+        "skip_polling_during_cooldown",
+        "plug_state_ttl",
+        "state_save_ticks",
+        "state_write_interval",
+    )
+
+    def __init__(self, config):
+        mqtt_config = config.get("mqtt") or {}
+        self.host = config.get("host")
+        self.desired_temperature = config.get("desired_temperature")
+        self.cooldown_minutes = config.get("cooldown_minutes", 15)
+        self.state_file = config.get("state_file")
+        self.kasa_username = config.get("kasa_username")
+        self.kasa_password = config.get("kasa_password")
+        self.enabled = config.get("enabled", True)
+        self.mqtt_enabled = bool(mqtt_config.get("enabled", False))
+        self.mqtt_broker = mqtt_config.get("broker", "localhost")
+        self.mqtt_port = mqtt_config.get("port", 1883)
+        self.mqtt_topic = mqtt_config.get("topic", "thermostat/temperature")
+        self.mqtt_max_age = mqtt_config.get("max_age_seconds", 300)
+        # Daemon intervals, None falls back to the --interval option
+        self.interval_fast = config.get("interval_fast")
+        self.interval_slow = config.get("interval_slow")
+        self.hysteresis = config.get("hysteresis", 1)
+        self.skip_polling_during_cooldown = config.get(
+            "skip_polling_during_cooldown", False
+        )
+        # None uses the default chosen by the run mode
+        self.plug_state_ttl = config.get("plug_state_ttl_seconds")
+        # State write batching, only applied in daemon mode
+        self.state_save_ticks = config.get("state_save_ticks", 5)
+        self.state_write_interval = config.get("state_write_interval", 300)
+
 
 class VirtualThermostat:
-    def __init__(self, config_file):
-        self.config_file = config_file
-        with open(config_file, "r") as f:
-            self.config = json.load(f)
+    def __init__(self, config):
+        """Create a thermostat from a config file path or a config dict.
+
+        A config given as a dict is used as-is and never reloaded.
+        """
+        self._config_mtime = None
+        if isinstance(config, dict):
+            self.config_file = None
+            self._apply_config(config)
+        else:
+            self.config_file = config
+            self._load_config()
         self.state = self._load_state()
 
-    def _mqtt_subscribe(self, fn, *args, **kwargs):
-        timeout = 1
-        if "timeout" in kwargs:
-            timeout = kwargs["timeout"]
-            del kwargs["timeout"]
-
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(fn, *args, **kwargs)
-            try:
-                return future.result(timeout=timeout)
-            except FutureTimeoutError:
-                raise TimeoutError(f"Function timed out after {timeout} seconds")
-
-    def _get_temperature_from_mqtt(self, broker, port, topic):
-        msg = self._mqtt_subscribe(
-            subscribe.simple,
-            topic,
-            hostname=broker,
-            port=port,
-            msg_count=1,
-            retained=True,
-            timeout=1,
+        # Last state written to disk and how many saves were deferred since
+        self._state_blob = None
+        self._state_pending = 0
+        # Whether routine writes are batched as configured by
+        # state_save_ticks and state_write_interval, set in daemon mode
+        self._state_batching = False
+        # The state last written minus last_run and the monotonic time of
+        # that write, used to throttle timestamp-only changes
+        self._state_content = None
+        self._state_written = None
+        # Wall clock time of the last cycle, stored as last_run when saving
+        self._last_run = None
+        # Make each write durable, the daemon skips this and relies on
+        # the atomic rename alone
+        self._state_fsync = True
+
+        # Smart plug connection reused across cycles
+        self._plug = PlugConnection()
+
+        # Last known plug state with the monotonic time it was read, reused
+        # for _plug_state_ttl seconds unless plug_state_ttl_seconds is set
+        self._plug_state = None
+        self._plug_state_time = None
+        self._plug_state_ttl = 0
+
+        # AC switch running in the background, see _start_control_ac
+        self._plug_task = None
+
+        # Monotonic time of the last AC change, derived from the state file
+        # once and tracked in memory afterwards
+        self._last_ac_change_mono = self._parse_last_ac_change()
+
+        # Long-lived MQTT subscriber, started on the first temperature read
+        self._mqtt = None
+
+    def _load_config(self):
+        """Load the config file and remember its modification time."""
+        self._config_mtime = os.stat(self.config_file).st_mtime_ns
+        with open(self.config_file, "rb") as f:
+            self._apply_config(orjson.loads(f.read()))
+
+    def _apply_config(self, config):
+        """Use a freshly loaded config dict and resolve its settings."""
+        self.config = config
+        self.settings = ThermostatSettings(config)
+
+    def _get_mqtt(self):
+        """Return the MQTT subscriber for the configured broker and topic.
+
+        The subscriber is created on the first temperature read and started
+        again when a config reload changes the broker, port or topic.
+        """
+        settings = self.settings
+        endpoint = (settings.mqtt_broker, settings.mqtt_port, settings.mqtt_topic)
+        mqtt = self._mqtt
+        if mqtt is not None and (mqtt.broker, mqtt.port, mqtt.topic) != endpoint:
+            logger.info("MQTT settings changed, reconnecting to %s", endpoint[0])
+            mqtt.close()
+            mqtt = None
+        if mqtt is None:
+            mqtt = self._mqtt = MQTTSubscriber(*endpoint)
+        return mqtt
+
+    async def _get_temperature_from_mqtt(self):
+        """Return the cached MQTT temperature, or None if missing or stale."""
+        temperature, _ = await self._get_mqtt().get_reading(
+            self.settings.mqtt_max_age, 1
         )
+        return temperature
 
-        if msg is None:
-            return None
-
-        try:
-            # Try to parse as JSON first (DHT11 format)
-            import json
-
-            data = json.loads(msg.payload.decode())
-            return float(data.get("temperature"))
-        except (json.JSONDecodeError, KeyError, TypeError):
-            # Fall back to plain number format
-            try:
-                return float(msg.payload.decode().strip())
-            except (ValueError, AttributeError):
-                return None
-
-    def _read_temperature(self):
+    async def _read_temperature(self):
         """Read temperature from MQTT source."""
-        mqtt_config = self.config.get("mqtt", {})
-
-        if not mqtt_config or not mqtt_config.get("enabled", False):
+        settings = self.settings
+        if not settings.mqtt_enabled:
             raise click.ClickException("MQTT is not enabled in configuration")
 
-        broker = mqtt_config.get("broker", "localhost")
-        port = mqtt_config.get("port", 1883)
-        topic = mqtt_config.get("topic", "thermostat/temperature")
-
         try:
-            temperature = self._get_temperature_from_mqtt(broker, port, topic)
+            temperature = await self._get_temperature_from_mqtt()
             if temperature is not None:
-                logger.info(f"Temperature from MQTT: {temperature}°C")
+                logger.info("Temperature from MQTT: %s°C", temperature)
                 return int(temperature)
             return None
         except Exception as e:
-            logger.error(f"Failed to get temperature from MQTT: {e}")
+            logger.error("Failed to get temperature from MQTT: %s", e)
             return None
 
     def _load_state(self):
-        """Load state from file."""
-        state_file = self.config["state_file"]
-        state_path = Path(state_file)
+        """Load state from file, falling back to DEFAULT_STATE."""
         try:
-            with open(state_path, "r") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {"last_ac_state": False, "last_run": None, "last_ac_change": None}
-
-    def _save_state(self):
-        """Save state to file."""
-        state_file = self.config["state_file"]
-        with open(state_file, "w") as f:
-            json.dump(self.state, f, indent=2)
+            state = orjson.loads(Path(self.settings.state_file).read_bytes())
+        except (orjson.JSONDecodeError, IOError):
+            return dict(DEFAULT_STATE)
+        if not isinstance(state, dict):
+            return dict(DEFAULT_STATE)
+        return state
+
+    def _save_state(self, force=False):
+        """Save state to file, skipping unchanged state and batching writes.
+
+        AC changes are written when force is set. When batching, other
+        changes are written every state_save_ticks calls, and a state that
+        differs only in last_run is written at most every
+        state_write_interval seconds.
+        """
+        save_ticks, write_interval = 1, 0
+        if self._state_batching:
+            settings = self.settings
+            save_ticks = settings.state_save_ticks
+            write_interval = settings.state_write_interval
+
+        content = None
+        if write_interval:
+            content = orjson.dumps(dict(self.state, last_run=None))
+            if not force and content == self._state_content:
+                # Only the timestamp changed, refresh it now and then
+                elapsed = time.monotonic() - self._state_written
+                if elapsed < write_interval:
+                    return
+
+        # last_run is only rendered as ISO text when it is about to be saved
+        if self._last_run is not None:
+            self.state["last_run"] = datetime.fromtimestamp(self._last_run).isoformat()
+
+        blob = orjson.dumps(self.state, option=STATE_DUMP_OPTION)
+        if blob == self._state_blob:
+            return
 
-    def _is_within_cooldown(self):
-        """Check if we're within the cooldown period since last AC state change."""
-        cooldown_minutes = self.config.get("cooldown_minutes", 15)
+        if not force and (content is None or content != self._state_content):
+            self._state_pending += 1
+            if self._state_pending < save_ticks:
+                return
+
+        # Write to a temporary file first so readers never see a partial state
+        state_file = self.settings.state_file
+        tmp_file = f"{state_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(blob)
+            if self._state_fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, state_file)
+
+        self._state_blob = blob
+        self._state_pending = 0
+        self._state_content = content
+        self._state_written = time.monotonic()
+
+    def _parse_last_ac_change(self):
+        """Convert the persisted last_ac_change into a monotonic time."""
         last_ac_change = self.state.get("last_ac_change")
-
         if not last_ac_change:
-            return False
+            return None
 
         try:
             last_change_time = datetime.fromisoformat(last_ac_change)
-            cooldown_end = last_change_time + timedelta(minutes=cooldown_minutes)
-            return datetime.now() < cooldown_end
         except (ValueError, TypeError):
+            return None
+        elapsed = (datetime.now() - last_change_time).total_seconds()
+        return time.monotonic() - elapsed
+
+    def _is_within_cooldown(self):
+        """Check if we're within the cooldown period since last AC state change."""
+        if self._last_ac_change_mono is None:
             return False
+        elapsed = time.monotonic() - self._last_ac_change_mono
+        return elapsed < self.settings.cooldown_minutes * 60
+
+    async def _get_plug(self):
+        """Return the smart plug, connecting to it on first use."""
+        settings = self.settings
+        return await self._plug.get(
+            settings.host, settings.kasa_username, settings.kasa_password
+        )
 
-    async def _control_ac(self, turn_on):
-        """Control the AC via smart plug."""
-        host = self.config["host"]
-        kasa_username = self.config.get("kasa_username")
-        kasa_password = self.config.get("kasa_password")
+    async def _refresh_plug(self):
+        """Update the cached plug, reconnecting once if the connection failed."""
+        plug = await self._get_plug()
         try:
-            if kasa_username and kasa_password:
-                from kasa import Discover
-
-                plug = await Discover.discover_single(
-                    host, username=kasa_username, password=kasa_password
-                )
-            else:
-                plug = SmartPlug(host)
             await plug.update()
+        except KasaException as e:
+            # The cached connection may be stale (expired session, new IP)
+            logger.info("Reconnecting to smart plug after error: %s", e)
+            self._plug.reset()
+            plug = await self._get_plug()
+            await plug.update()
+        return plug
+
+    async def _control_ac(self, turn_on, expected_current=None):
+        """Control the AC via smart plug.
 
-            current_state = plug.is_on
-            if current_state == turn_on:
-                logger.info(f"AC already {'ON' if turn_on else 'OFF'}")
-                return current_state
+        expected_current is the plug state already read during this cycle,
+        when given it is trusted instead of querying the plug again.
+        """
+        if expected_current == turn_on:
+            logger.info("AC already %s", "ON" if turn_on else "OFF")
+            return expected_current
+
+        try:
+            if expected_current is None:
+                plug = await self._refresh_plug()
+
+                current_state = plug.is_on
+                self._remember_plug_state(current_state)
+                if current_state == turn_on:
+                    logger.info("AC already %s", "ON" if turn_on else "OFF")
+                    return current_state
+
+            else:
+                plug = await self._get_plug()
 
             if turn_on:
                 await plug.turn_on()
@@ -146,74 +341,163 @@ class VirtualThermostat:
                 await plug.turn_off()
                 logger.info("Turned AC OFF")
 
+            self._remember_plug_state(turn_on)
             return turn_on
         except Exception as e:
+            # Connect again and read the plug state on the next attempt
+            self._plug.reset()
+            self._plug_state_time = None
             if "authentication" in str(e).lower() or "login" in str(e).lower():
                 logger.error(
-                    f"Kasa authentication failed - check username/password: {e}"
+                    "Kasa authentication failed - check username/password: %s", e
                 )
             else:
-                logger.error(f"Error controlling AC: {e}")
+                logger.error("Error controlling AC: %s", e)
             return None
 
-    async def run_once(self):
-        """Main thermostat control logic."""
-        with open(self.config_file, "r") as f:
-            self.config = json.load(f)
+    def _start_control_ac(self, turn_on, expected_current=None):
+        """Switch the AC in a background task instead of awaiting the plug.
 
-        # Check if thermostat is enabled in config
-        if not self.config.get("enabled", True):
-            logger.info("Thermostat is disabled in configuration")
+        The new state and change time are recorded right away and reverted
+        by _on_control_ac_done if the plug could not be switched.
+        """
+        previous = (
+            self.state.get("last_ac_state", False),
+            self.state.get("last_ac_change"),
+            self._last_ac_change_mono,
+        )
+        self.state["last_ac_state"] = turn_on
+        self.state["last_ac_change"] = datetime.fromtimestamp(
+            self._last_run if self._last_run is not None else time.time()
+        ).isoformat()
+        self._last_ac_change_mono = time.monotonic()
+
+        task = asyncio.create_task(
+            self._control_ac(turn_on, expected_current=expected_current)
+        )
+        task.add_done_callback(lambda t: self._on_control_ac_done(t, turn_on, previous))
+        self._plug_task = task
+
+    def _on_control_ac_done(self, task, turn_on, previous):
+        """Reconcile the stored AC state with the result of a plug switch.
+
+        previous holds the AC state, change time and monotonic change time
+        from before the switch was started.
+        """
+        self._plug_task = None
+        if task.cancelled():
+            new_ac_state = None
+        else:
+            new_ac_state = task.result()
+        if new_ac_state == turn_on:
             return
 
-        desired_temperature = self.config["desired_temperature"]
-        last_ac_state = self.state.get("last_ac_state", False)
+        logger.warning("AC could not be turned %s", "ON" if turn_on else "OFF")
+        previous_state, previous_change, previous_change_mono = previous
+        self.state["last_ac_state"] = (
+            previous_state if new_ac_state is None else new_ac_state
+        )
+        # The switch never happened, so it must not start a cooldown
+        self.state["last_ac_change"] = previous_change
+        self._last_ac_change_mono = previous_change_mono
+        self._save_state(force=True)
+
+    async def close(self):
+        """Wait for a pending AC switch and disconnect from the MQTT broker."""
+        if self._plug_task is not None:
+            await asyncio.wait([self._plug_task])
+
+        if self._mqtt is not None:
+            self._mqtt.close()
+            self._mqtt = None
+
+    def _remember_plug_state(self, is_on):
+        """Cache the plug state that was just read or commanded."""
+        self._plug_state = is_on
+        self._plug_state_time = time.monotonic()
+
+    async def _read_plug_state(self):
+        """Return whether the AC plug is on, or None if it cannot be reached."""
+        ttl = self.settings.plug_state_ttl
+        if ttl is None:
+            ttl = self._plug_state_ttl
+        if (
+            self._plug_state_time is not None
+            and time.monotonic() - self._plug_state_time < ttl
+        ):
+            return self._plug_state
 
-        # Check current actual AC state from smart plug
         try:
-            host = self.config["host"]
-            kasa_username = self.config.get("kasa_username")
-            kasa_password = self.config.get("kasa_password")
-            if kasa_username and kasa_password:
-                from kasa import Discover
-
-                plug = await Discover.discover_single(
-                    host, username=kasa_username, password=kasa_password
-                )
-            else:
-                plug = SmartPlug(host)
-            await plug.update()
-            current_ac_state = plug.is_on
-
-            # Update our state if it differs from reality
-            if current_ac_state != last_ac_state:
-                logger.info(
-                    f"AC state mismatch detected. Expected: {last_ac_state}, Actual: {current_ac_state}"
-                )
-                self.state["last_ac_state"] = current_ac_state
-                last_ac_state = current_ac_state
-
+            plug = await self._refresh_plug()
+            self._remember_plug_state(plug.is_on)
+            return plug.is_on
         except Exception as e:
+            self._plug_state_time = None
             if "authentication" in str(e).lower() or "login" in str(e).lower():
                 logger.error(
-                    f"Kasa authentication failed - check username/password: {e}"
+                    "Kasa authentication failed - check username/password: %s", e
                 )
                 raise click.ClickException(f"Authentication failed: {e}")
-            else:
-                logger.warning(f"Could not check current AC state: {e}")
             # Continue with stored state if we can't check actual state
+            logger.warning("Could not check current AC state: %s", e)
+            return None
+
+    async def run_once(self):
+        """Main thermostat control logic."""
+        # Reload the config only when the file has been modified
+        if (
+            self.config_file is not None
+            and os.stat(self.config_file).st_mtime_ns != self._config_mtime
+        ):
+            self._load_config()
+        settings = self.settings
+
+        # Check if thermostat is enabled in config
+        if not settings.enabled:
+            logger.info("Thermostat is disabled in configuration")
+            return
+
+        # Single timestamp for every bookkeeping field of this cycle, rendered
+        # as ISO text only when the state is saved
+        self._last_run = time.time()
+
+        # Nothing can change during the cooldown, optionally skip the I/O
+        if settings.skip_polling_during_cooldown and self._is_within_cooldown():
+            logger.info("Within cooldown, skipping plug and temperature checks")
+            self._save_state()
+            return
+
+        desired_temperature = settings.desired_temperature
+        last_ac_state = self.state.get("last_ac_state", False)
+        ac_state_changed = False
+
+        # The plug and the temperature sensor are independent, query both
+        # at the same time
+        plug_state, temperature = await asyncio.gather(
+            self._read_plug_state(), self._read_temperature()
+        )
+
+        # Update our state if it differs from reality
+        if plug_state is not None and plug_state != last_ac_state:
+            logger.info(
+                "AC state mismatch detected. Expected: %s, Actual: %s",
+                last_ac_state,
+                plug_state,
+            )
+            self.state["last_ac_state"] = plug_state
+            last_ac_state = plug_state
+            ac_state_changed = True
 
-        temperature = self._read_temperature()
         if temperature is None:
             temperature = self.state.get("last_temperature")
             if temperature is None:
                 raise click.ClickException("No temperature available")
-            logger.info(f"Using last known temperature: {temperature}°C")
+            logger.info("Using last known temperature: %s°C", temperature)
         else:
-            logger.info(f"Current temperature: {temperature}°C")
+            logger.info("Current temperature: %s°C", temperature)
             self.state["last_temperature"] = temperature
 
-        logger.info(f"Desired temperature: {desired_temperature}°C")
+        logger.info("Desired temperature: %s°C", desired_temperature)
 
         # Determine AC action
         desired_state = last_ac_state
@@ -224,42 +508,91 @@ class VirtualThermostat:
 
         # Control AC if state should change
         if desired_state != last_ac_state:
-            if self._is_within_cooldown():
-                cooldown_minutes = self.config.get("cooldown_minutes", 15)
+            if self._plug_task is not None:
+                logger.info("AC state change still in progress")
+            elif self._is_within_cooldown():
                 logger.info(
-                    f"AC state change desired but within {cooldown_minutes}min cooldown"
+                    "AC state change desired but within %smin cooldown",
+                    settings.cooldown_minutes,
                 )
             else:
                 action_text = "ON" if desired_state else "OFF"
-                logger.info(f"Temperature {temperature}°C, turning AC {action_text}")
-                new_ac_state = await self._control_ac(desired_state)
-                if new_ac_state is not None and new_ac_state != last_ac_state:
-                    self.state["last_ac_state"] = new_ac_state
-                    self.state["last_ac_change"] = datetime.now().isoformat()
+                logger.info("Temperature %s°C, turning AC %s", temperature, action_text)
+                self._start_control_ac(desired_state, expected_current=plug_state)
+                ac_state_changed = True
         else:
-            logger.info(f"No action needed. AC is {'ON' if last_ac_state else 'OFF'}")
-
-        # Save state
-        self.state["last_run"] = datetime.now().isoformat()
-        self._save_state()
+            logger.info("No action needed. AC is %s", "ON" if last_ac_state else "OFF")
+
+        # Save state, AC changes are always written right away
+        self._save_state(force=ac_state_changed)
+
+    def _next_interval(self, interval):
+        """Return the delay before the next daemon cycle.
+
+        Poll quickly near the desired temperature and slowly far from it.
+        During the cooldown nothing can change, so wait until it is over.
+        """
+        settings = self.settings
+        interval_fast = settings.interval_fast or interval
+        interval_slow = settings.interval_slow or interval
+
+        if self._is_within_cooldown():
+            remaining = settings.cooldown_minutes * 60 - (
+                time.monotonic() - self._last_ac_change_mono
+            )
+            return max(1, min(remaining, interval_slow))
+
+        temperature = self.state.get("last_temperature")
+        if temperature is None or settings.desired_temperature is None:
+            return interval
+        if abs(temperature - settings.desired_temperature) <= settings.hysteresis:
+            return interval_fast
+        return interval_slow
 
     async def run_daemon(self, interval):
         """Run thermostat continuously as a daemon."""
-        logger.info(f"Starting thermostat daemon (interval: {interval}s)")
-        logger.info(
-            f"MQTT broker: {self.config.get('mqtt', {}).get('broker', 'localhost')}"
-        )
-
+        logger.info("Starting thermostat daemon (interval: %ss)", interval)
+        logger.info("MQTT broker: %s", self.settings.mqtt_broker)
+
+        # Only write routine state updates every few cycles
+        self._state_batching = True
+        # The plug rarely changes state other than through _control_ac,
+        # reuse its last known state for up to one polling interval
+        self._plug_state_ttl = min(interval, 30)
+        self._state_fsync = False
+
+        # Run cycles on a fixed schedule so their run time does not drift,
+        # each step is chosen from the temperature read in the cycle
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
         try:
             while True:
                 try:
                     await self.run_once()
                 except Exception as e:
-                    logger.error(f"Error in thermostat cycle: {e}")
-
-                await asyncio.sleep(interval)
+                    logger.error("Error in thermostat cycle: %s", e)
+
+                # Write out the log records buffered during this cycle
+                for handler in logging.getLogger().handlers:
+                    handler.flush()
+
+                step = self._next_interval(interval)
+                next_tick += step
+                now = loop.time()
+                if now > next_tick:
+                    # Skip the ticks missed by a slow cycle instead of
+                    # running the next cycles back to back
+                    missed = (now - next_tick) // step + 1
+                    next_tick += missed * step
+                await asyncio.sleep(next_tick - now)
         except KeyboardInterrupt:
             logger.info("Stopping thermostat daemon (Ctrl+C pressed)")
+        except asyncio.CancelledError:
+            # asyncio.run cancels the daemon on Ctrl+C since Python 3.11
+            logger.info("Stopping thermostat daemon (cancelled)")
+            raise
+        finally:
+            self._save_state(force=True)
 
 
 @click.command()
@@ -274,7 +607,8 @@ class VirtualThermostat:
     "--log-level",
     type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]),
     default="WARNING",
-    help="Set the logging level",
+    envvar="LOG_LEVEL",
+    help="Set the logging level (or LOG_LEVEL environment variable)",
 )
 def cli_main(config, daemon, interval, log_level):
     """Virtual Thermostat - Temperature-controlled AC script"""
@@ -288,10 +622,35 @@ def cli_main(config, daemon, interval, log_level):
 
     thermostat = VirtualThermostat(config)
 
+    async def run():
+        try:
+            if daemon:
+                await thermostat.run_daemon(interval)
+            else:
+                await thermostat.run_once()
+        finally:
+            await thermostat.close()
+
+    root = logging.getLogger()
+    handlers = root.handlers
     if daemon:
-        asyncio.run(thermostat.run_daemon(interval))
-    else:
-        asyncio.run(thermostat.run_once())
+        # Buffer log records so each cycle is written out in a single flush
+        root.handlers = [
+            (
+                BufferedLogHandler(64, flushLevel=logging.ERROR, target=handler)
+                if isinstance(handler, logging.StreamHandler)
+                else handler
+            )
+            for handler in handlers
+        ]
+    try:
+        asyncio.run(run())
+    finally:
+        # Write out the remaining records and put the stream handlers back
+        buffered = [h for h in root.handlers if isinstance(h, BufferedLogHandler)]
+        root.handlers = handlers
+        for handler in buffered:
+            handler.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+Long-lived MQTT and smart plug connections shared by the daemons and the UI.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+import orjson
+import paho.mqtt.client as mqtt
+from kasa import SmartPlug
+
+logger = logging.getLogger("virtual-thermostat")
+
+
+def parse_reading(payload):
+    """Parse a DHT11 JSON or plain number payload.
+
+    Returns the temperature, the humidity and the ISO publish timestamp,
+    the last two only when the payload carries them.
+    """
+    try:
+        # Try to parse as JSON first (DHT11 format)
+        data = orjson.loads(payload)
+        temperature = data.get("temperature")
+        humidity = data.get("humidity")
+        return (
+            float(temperature) if temperature is not None else None,
+            float(humidity) if humidity is not None else None,
+            data.get("timestamp"),
+        )
+    except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+        # Fall back to plain number format (temperature only)
+        try:
+            return float(payload.decode().strip()), None, None
+        except (ValueError, AttributeError):
+            return None, None, None
+
+
+class MQTTSubscriber:
+    """Keep the latest reading published on an MQTT topic.
+
+    The client is connected on the first read and stays subscribed, so
+    every later read returns the cached message without a round trip.
+    """
+
+    def __init__(self, broker, port, topic):
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self._client = None
+        # Latest (temperature, humidity, monotonic receive time)
+        self._reading = None
+        # Event awaited for the first reading and the loop it belongs to
+        self._event = None
+        self._loop = None
+
+    def start(self):
+        """Connect the client in the background and subscribe to the topic."""
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.connect_async(self.broker, self.port)
+        client.loop_start()
+        self._client = client
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        """Subscribe to the topic once connected."""
+        if reason_code.is_failure:
+            logger.error("MQTT connection failed: %s", reason_code)
+            return
+        # Subscribe on every (re)connect, the broker replays the retained value.
+        # QoS 0 is enough for a periodic reading and avoids acknowledgements.
+        client.subscribe(self.topic, qos=0)
+
+    def _on_message(self, client, userdata, msg):
+        """Cache the latest reading published on the topic."""
+        temperature, humidity, timestamp = parse_reading(msg.payload)
+        if temperature is None:
+            logger.warning("Ignoring invalid MQTT payload: %r", msg.payload)
+            return
+
+        received = time.monotonic()
+        if msg.retain and timestamp:
+            # A retained message is replayed on subscribe and may be old,
+            # age it from the time it was published
+            try:
+                published = datetime.fromisoformat(timestamp)
+                received -= max((datetime.now() - published).total_seconds(), 0)
+            except (ValueError, TypeError):
+                pass
+        self._reading = (temperature, humidity, received)
+
+        # Wake up a coroutine waiting for the first reading, this callback
+        # runs in the paho network thread
+        event = self._event
+        if event is not None:
+            self._loop.call_soon_threadsafe(event.set)
+
+    async def get_reading(self, max_age, timeout):
+        """Return the latest temperature and humidity.
+
+        Waits up to timeout seconds for the first message, readings older
+        than max_age seconds are reported as missing.
+        """
+        if self._client is None:
+            self.start()
+
+        # Wait for the first (retained) message without blocking the event loop
+        if self._reading is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+            try:
+                # The message may have landed before the event was published
+                if self._reading is None:
+                    await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None, None
+            finally:
+                self._event = None
+
+        temperature, humidity, received = self._reading
+        if time.monotonic() - received > max_age:
+            logger.warning("MQTT reading is older than %ss", max_age)
+            return None, None
+        return temperature, humidity
+
+    def close(self):
+        """Disconnect the client if it was started."""
+        if self._client is not None:
+            # Disconnect first so the network loop sends the DISCONNECT packet
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
+
+
+class PlugConnection:
+    """Smart plug connection reused until the host or credentials change."""
+
+    def __init__(self):
+        self.plug = None
+        self._key = None
+
+    async def get(self, host, username=None, password=None):
+        """Return the smart plug for host, connecting to it on first use."""
+        key = (host, username, password)
+        if self.plug is None or self._key != key:
+            if username and password:
+                from kasa import Discover
+
+                self.plug = await Discover.discover_single(
+                    host, username=username, password=password
+                )
+            else:
+                self.plug = SmartPlug(host)
+            self._key = key
+        return self.plug
+
+    def reset(self):
+        """Drop the connection so the next get() connects again."""
+        self.plug = None
@@ -5,13 +5,15 @@ Reads data from DHT11 sensor and writes temperature to a file for the thermostat
 Supports MQTT publishing and both hardware and simulation modes.
 """
 
-import json
+import functools
 import logging
+import random
 import time
 from datetime import datetime
 
 import click
-import paho.mqtt.publish as publish
+import orjson
+import paho.mqtt.client as mqtt
 
 try:
     import Adafruit_DHT
@@ -20,6 +22,20 @@ except ImportError:
 
 logger = logging.getLogger("dht11-reader")
 
+# The DHT11 cannot be sampled much faster than once a second, readings
+# requested within this many seconds reuse the previous one
+MIN_READ_INTERVAL = 1.5
+
+# Random source for simulated readings, bound once instead of per read
+_sim_uniform = random.Random().uniform
+
+
+@functools.lru_cache(maxsize=2)
+def _format_timestamp(epoch_second):
+    """Return the log and ISO text of a whole second, cached per second."""
+    dt = datetime.fromtimestamp(epoch_second)
+    return dt.strftime("%Y/%m/%d %H:%M:%S"), dt.isoformat()
+
 
 class DHT11Sensor:
     """DHT11 temperature and humidity sensor reader with MQTT support."""
@@ -35,26 +51,64 @@ class DHT11Sensor:
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
         self.mqtt_topic = mqtt_topic
+        # Last successful hardware reading and its monotonic time
+        self._last_reading = None
+        self._last_reading_time = 0.0
+        # Reader chosen once, simulation when the driver is not installed
+        self._read = self._read_hardware if Adafruit_DHT else self._read_simulated
+        # Connected on the first publish and reused for every reading
+        self._client = None
+
+    def _get_client(self):
+        """Return the MQTT client, connecting to the broker on first use."""
+        if self._client is None:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+            client.connect(self.mqtt_broker, self.mqtt_port)
+            # The network loop also reconnects if the broker goes away
+            client.loop_start()
+            self._client = client
+        return self._client
+
+    def close(self):
+        """Send pending messages and disconnect from the MQTT broker."""
+        if self._client is not None:
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
 
     def read_sensor(self, simulate=False):
         """Read temperature and humidity from DHT11 sensor."""
-        if simulate or not Adafruit_DHT:
-            import random
-
-            temperature = round(20 + random.uniform(-5, 10), 1)
-            humidity = round(40 + random.uniform(-10, 20), 1)
-            logger.debug(f"Simulated reading: {temperature}°C, {humidity}%")
-            return temperature, humidity
+        if simulate:
+            return self._read_simulated()
+        return self._read()
+
+    def _read_simulated(self):
+        """Return a random reading in a plausible indoor range."""
+        temperature = round(20 + _sim_uniform(-5, 10), 1)
+        humidity = round(40 + _sim_uniform(-10, 20), 1)
+        logger.debug("Simulated reading: %s°C, %s%%", temperature, humidity)
+        return temperature, humidity
+
+    def _read_hardware(self):
+        """Read the DHT11 sensor through Adafruit_DHT."""
+        now = time.monotonic()
+        if (
+            self._last_reading is not None
+            and now - self._last_reading_time < MIN_READ_INTERVAL
+        ):
+            return self._last_reading
 
         try:
             humidity, temperature = Adafruit_DHT.read_retry(
                 Adafruit_DHT.DHT11, self.pin
             )
             if humidity is not None and temperature is not None:
+                self._last_reading = (temperature, humidity)
+                self._last_reading_time = now
                 return temperature, humidity
             return None, None
         except Exception as e:
-            logger.warning(f"DHT11 sensor reading error: {e}")
+            logger.warning("DHT11 sensor reading error: %s", e)
             return None, None
 
     def publish_mqtt(self, temperature, humidity):
@@ -66,30 +120,33 @@ class DHT11Sensor:
             data = {
                 "temperature": temperature,
                 "humidity": round(humidity, 1),
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": _format_timestamp(int(time.time()))[1],
             }
 
-            publish.single(
-                self.mqtt_topic,
-                json.dumps(data),
-                hostname=self.mqtt_broker,
-                port=self.mqtt_port,
-                retain=True,
+            payload = orjson.dumps(data)
+            info = self._get_client().publish(
+                self.mqtt_topic, payload, qos=0, retain=True
             )
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                logger.error("Error publishing to MQTT: %s", mqtt.error_string(info.rc))
+                return False
 
-            logger.debug(
-                f"Published to MQTT topic '{self.mqtt_topic}': {json.dumps(data)}"
-            )
+            logger.debug("Published to MQTT topic '%s': %s", self.mqtt_topic, payload)
             return True
         except Exception as e:
-            logger.error(f"Error publishing to MQTT: {e}")
+            logger.error("Error publishing to MQTT: %s", e)
             return False
 
     def log_reading(self, temperature, humidity):
         """Log the sensor reading with timestamp."""
-        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        timestamp = _format_timestamp(int(time.time()))[0]
         logger.info(
-            f"[{timestamp}] Temperature: {temperature:.1f}°C, Humidity: {humidity:.1f}%"
+            "[%s] Temperature: %.1f°C, Humidity: %.1f%%",
+            timestamp,
+            temperature,
+            humidity,
         )
 
     def run_continuous(self, interval, simulate=False):
@@ -99,18 +156,25 @@ class DHT11Sensor:
 
         mode = "simulation" if simulate or not Adafruit_DHT else "hardware"
         logger.info(
-            f"Starting continuous DHT11 reading ({mode} mode, GPIO pin {self.pin}, interval {interval}s)"
+            "Starting continuous DHT11 reading (%s mode, GPIO pin %s, interval %ss)",
+            mode,
+            self.pin,
+            interval,
         )
-        logger.info(f"Publishing to MQTT broker: {self.mqtt_broker}")
+        logger.info("Publishing to MQTT broker: %s", self.mqtt_broker)
 
         if not Adafruit_DHT:
             logger.warning(
                 "Adafruit_DHT library not available - running in simulation mode"
             )
 
+        # Schedule readings on a fixed grid so read and publish time don't
+        # accumulate as drift
+        read = self._read_simulated if simulate else self._read
+        next_tick = time.monotonic()
         try:
             while True:
-                temperature, humidity = self.read_sensor(simulate or not Adafruit_DHT)
+                temperature, humidity = read()
 
                 if temperature is not None and humidity is not None:
                     self.log_reading(temperature, humidity)
@@ -118,10 +182,19 @@ class DHT11Sensor:
                 else:
                     logger.warning("Skipping publish due to invalid sensor reading")
 
-                time.sleep(interval)
+                next_tick += interval
+                now = time.monotonic()
+                if now > next_tick:
+                    # Skip the deadlines missed by a slow reading instead of
+                    # reading again right away
+                    missed = (now - next_tick) // interval + 1
+                    next_tick += missed * interval
+                time.sleep(next_tick - now)
 
         except KeyboardInterrupt:
             logger.info("Stopping DHT11 reader (Ctrl+C pressed)")
+        finally:
+            self.close()
 
     def run_once(self, simulate=False):
         """Read sensor once and publish to MQTT."""
@@ -129,18 +202,19 @@ class DHT11Sensor:
             raise click.ClickException("MQTT broker is required")
 
         mode = "simulation" if simulate or not Adafruit_DHT else "hardware"
-        logger.info(f"Reading DHT11 sensor once ({mode} mode, GPIO pin {self.pin})")
+        logger.info("Reading DHT11 sensor once (%s mode, GPIO pin %s)", mode, self.pin)
 
         if not Adafruit_DHT:
             logger.warning(
                 "Adafruit_DHT library not available - running in simulation mode"
             )
 
-        temperature, humidity = self.read_sensor(simulate or not Adafruit_DHT)
+        temperature, humidity = self.read_sensor(simulate)
 
         if temperature is not None and humidity is not None:
             self.log_reading(temperature, humidity)
             self.publish_mqtt(temperature, humidity)
+            self.close()
             return True
         else:
             raise click.ClickException("Failed to read valid data from DHT11 sensor")
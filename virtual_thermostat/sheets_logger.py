@@ -5,27 +5,63 @@ Subscribes to MQTT temperature/humidity data and uploads to Google Sheets at con
 """
 
 import asyncio
-import json
+import functools
 import logging
+import os
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
+import aiohttp
 import click
-import paho.mqtt.subscribe as subscribe
 import gspread
-import requests
+import orjson
 from google.oauth2.service_account import Credentials
-from kasa import SmartPlug
+
+from virtual_thermostat.connections import MQTTSubscriber, PlugConnection
 
 logger = logging.getLogger("sheets-logger")
 
+# Bounds of the wait before retrying wttr.in after a failed request
+OUTSIDE_BACKOFF_MIN = 60
+OUTSIDE_BACKOFF_MAX = 3600
+
+# Rows kept while Google Sheets cannot be reached, the oldest are dropped
+MAX_PENDING_ROWS = 1000
+
+# State reported when the state file is missing or cannot be read
+DEFAULT_STATE_DATA = {
+    "last_ac_state": False,
+    "last_run": "Never",
+    "last_ac_change": "Never",
+    "last_temperature": None,
+}
+
+# Format of the timestamps written to the sheet
+TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+# Unit suffix of a wttr.in metric temperature, as UTF-8 bytes
+CELSIUS_SUFFIX = "°C".encode()
+
+
+@functools.lru_cache(maxsize=128)
+def _format_iso(text):
+    """Return an ISO timestamp in the sheet format, cached per input text.
+
+    Text that cannot be parsed is returned unchanged.
+    """
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except (ValueError, TypeError, AttributeError):
+        return text
+    return dt.strftime(TIMESTAMP_FORMAT)
+
 
 class SheetsLogger:
     def __init__(self, config_file):
         self.config_file = config_file
-        with open(config_file, "r") as f:
-            self.config = json.load(f)
+        self._config_mtime = None
+        self._load_config()
 
         self.last_upload = None
         self.current_data = {
@@ -34,13 +70,41 @@ class SheetsLogger:
             "outside_temperature": None,
         }
         self.state_data = {}
+        # Path and modification time of the state file behind state_data
+        self._state_key = None
         self.current_power = 0
         self.gc = None
         self.worksheet = None
+        # Keep-alive HTTP session reused for every wttr.in request, created
+        # on first use since it must belong to the running event loop
+        self._http = None
+        # Rows waiting to be appended to the worksheet in a single request
+        self._pending_rows = []
+        # Last outside temperature and the monotonic time it was fetched
+        self._outside_temperature = None
+        self._outside_temperature_time = None
+        # Current retry delay after wttr.in failures and when it expires
+        self._outside_backoff = 0
+        self._outside_retry_time = None
+        # Smart plug connection reused across cycles
+        self._plug = PlugConnection()
+        # Long-lived MQTT subscriber, started on the first sensor read
+        self._mqtt = None
 
         # Initialize Google Sheets connection
         self._setup_sheets_connection()
 
+    def _load_config(self):
+        """Load the config file and remember its modification time."""
+        self._config_mtime = os.stat(self.config_file).st_mtime_ns
+        with open(self.config_file, "rb") as f:
+            self.config = orjson.loads(f.read())
+
+        # Row fields that only change with the config
+        self._device = self.config.get("device_name", "virtual-thermostat")
+        self._thermostat_enabled = "YES" if self.config.get("enabled", True) else "NO"
+        self._desired_temp = self.config.get("desired_temperature", "")
+
     def _setup_sheets_connection(self):
         """Setup Google Sheets API connection."""
         sheets_config = self.config.get("google_sheets", {})
@@ -95,153 +159,183 @@ class SheetsLogger:
                     "Power (W)",
                 ]
                 self.worksheet.update("A1:K1", [headers])
-                logger.info(f"Created new worksheet: {worksheet_name}")
+                logger.info("Created new worksheet: %s", worksheet_name)
 
             logger.info(
-                f"Connected to Google Sheets: {spreadsheet.title} -> {worksheet_name}"
+                "Connected to Google Sheets: %s -> %s",
+                spreadsheet.title,
+                worksheet_name,
             )
 
         except Exception as e:
             raise click.ClickException(f"Failed to setup Google Sheets connection: {e}")
 
-    def _mqtt_subscribe(self, fn, *args, **kwargs):
-        """Helper to run MQTT subscribe with timeout."""
-        timeout = 1
-        if "timeout" in kwargs:
-            timeout = kwargs["timeout"]
-            del kwargs["timeout"]
+    def _get_mqtt(self):
+        """Return the MQTT subscriber for the configured broker and topic.
 
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(fn, *args, **kwargs)
-            try:
-                return future.result(timeout=timeout)
-            except FutureTimeoutError:
-                raise TimeoutError(f"Function timed out after {timeout} seconds")
-
-    def _get_data_from_mqtt(self, broker, port, topic):
-        """Get temperature and humidity data from MQTT."""
-        msg = self._mqtt_subscribe(
-            subscribe.simple,
-            topic,
-            hostname=broker,
-            port=port,
-            msg_count=1,
-            retained=True,
-            timeout=15,
+        The subscriber is created on the first sensor read and started
+        again when a config reload changes the broker, port or topic.
+        """
+        mqtt_config = self.config.get("mqtt", {})
+        endpoint = (
+            mqtt_config.get("broker", "localhost"),
+            mqtt_config.get("port", 1883),
+            mqtt_config.get("topic", "thermostat/temperature"),
         )
-
-        if msg is None:
-            return None, None
-
-        try:
-            # Try to parse as JSON first (DHT11 format)
-            data = json.loads(msg.payload.decode())
-            temperature = data.get("temperature")
-            humidity = data.get("humidity")
-            return float(temperature) if temperature is not None else None, (
-                float(humidity) if humidity is not None else None
+        mqtt = self._mqtt
+        if mqtt is not None and (mqtt.broker, mqtt.port, mqtt.topic) != endpoint:
+            logger.info("MQTT settings changed, reconnecting to %s", endpoint[0])
+            mqtt.close()
+            mqtt = None
+        if mqtt is None:
+            mqtt = self._mqtt = MQTTSubscriber(*endpoint)
+        return mqtt
+
+    async def _get_outside_temperature(self):
+        """Get the outside temperature, refetching it once the cache expires.
+
+        The last known value is kept when wttr.in cannot be reached, and
+        failed requests are retried with an exponential backoff.
+        """
+        sheets_config = self.config.get("google_sheets", {})
+        ttl = sheets_config.get("outside_temp_ttl_minutes", 10) * 60
+        now = time.monotonic()
+        if (
+            self._outside_temperature_time is not None
+            and now - self._outside_temperature_time < ttl
+        ):
+            return self._outside_temperature
+        if self._outside_retry_time is not None and now < self._outside_retry_time:
+            return self._outside_temperature
+
+        temperature = await self._fetch_outside_temperature()
+        now = time.monotonic()
+        if temperature is not None:
+            self._outside_temperature = temperature
+            self._outside_temperature_time = now
+            self._outside_backoff = 0
+            self._outside_retry_time = None
+        else:
+            self._outside_backoff = min(
+                max(self._outside_backoff * 2, OUTSIDE_BACKOFF_MIN),
+                OUTSIDE_BACKOFF_MAX,
             )
-        except (json.JSONDecodeError, KeyError, TypeError):
-            # Fall back to plain number format (temperature only)
-            try:
-                temperature = float(msg.payload.decode().strip())
-                return temperature, None
-            except (ValueError, AttributeError):
-                return None, None
+            self._outside_retry_time = now + self._outside_backoff
+            logger.debug("Retrying wttr.in in %ss", self._outside_backoff)
+        return self._outside_temperature
 
-    def _get_outside_temperature(self):
+    async def _fetch_outside_temperature(self):
         """Get outside temperature from wttr.in weather service."""
         try:
+            if self._http is None:
+                self._http = aiohttp.ClientSession(
+                    # Fail fast when wttr.in cannot be reached at all
+                    timeout=aiohttp.ClientTimeout(total=5, connect=2, sock_read=3),
+                    connector=aiohttp.TCPConnector(limit=4, ttl_dns_cache=300),
+                )
+
             # Use wttr.in with format %t to get just temperature
-            response = requests.get("http://wttr.in/?m&format=%t", timeout=5)
-            response.raise_for_status()
-
-            # Parse the response (format: "+15°C" or "-5°C")
-            temp_str = response.text.strip()
-            if temp_str.endswith("°C"):
-                temp_value = temp_str[:-2]  # Remove '°C'
-                # Remove leading '+' if present
-                if temp_value.startswith("+"):
-                    temp_value = temp_value[1:]
-                temperature = float(temp_value)
-                logger.debug(f"Outside temperature from wttr.in: {temperature}°C")
+            async with self._http.get("http://wttr.in/?m&format=%t") as response:
+                response.raise_for_status()
+                content = await response.read()
+
+            # Parse the response (format: "+15°C" or "-5°C") from the bytes,
+            # float() accepts them along with the leading '+' sign
+            raw = content.strip()
+            if raw.endswith(CELSIUS_SUFFIX):
+                temperature = float(raw[: -len(CELSIUS_SUFFIX)])
+                logger.debug("Outside temperature from wttr.in: %s°C", temperature)
                 return temperature
             else:
-                logger.warning(f"Unexpected format from wttr.in: {temp_str}")
+                logger.warning("Unexpected format from wttr.in: %r", raw)
                 return None
 
-        except requests.RequestException as e:
-            logger.warning(f"Failed to get outside temperature from wttr.in: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Failed to get outside temperature from wttr.in: %r", e)
             return None
         except (ValueError, TypeError) as e:
-            logger.warning(f"Failed to parse outside temperature: {e}")
+            logger.warning("Failed to parse outside temperature: %s", e)
             return None
 
-    def _read_sensor_data(self):
+    async def _read_sensor_data(self):
         """Read temperature and humidity from MQTT source."""
         mqtt_config = self.config.get("mqtt", {})
 
         if not mqtt_config or not mqtt_config.get("enabled", False):
             raise click.ClickException("MQTT is not enabled in configuration")
 
-        broker = mqtt_config.get("broker", "localhost")
-        port = mqtt_config.get("port", 1883)
-        topic = mqtt_config.get("topic", "thermostat/temperature")
+        max_age = mqtt_config.get("max_age_seconds", 300)
 
         try:
-            temperature, humidity = self._get_data_from_mqtt(broker, port, topic)
+            # Fetch the outside temperature while waiting for the MQTT reading
+            (temperature, humidity), outside_temp = await asyncio.gather(
+                self._get_mqtt().get_reading(max_age, 15),
+                self._get_outside_temperature(),
+            )
             if temperature is not None:
                 logger.debug(
-                    f"Data from MQTT - Temperature: {temperature}°C, Humidity: {humidity}%"
+                    "Data from MQTT - Temperature: %s°C, Humidity: %s%%",
+                    temperature,
+                    humidity,
                 )
                 self.current_data["temperature"] = temperature
                 self.current_data["humidity"] = humidity
-
-                # Get outside temperature
-                outside_temp = self._get_outside_temperature()
                 self.current_data["outside_temperature"] = outside_temp
 
                 return True
             return False
         except Exception as e:
-            logger.error(f"Failed to get data from MQTT: {e}")
+            logger.error("Failed to get data from MQTT: %s", e)
             return False
 
-    def _read_state_data(self):
-        """Read current state from state file."""
-        state_file = self.config.get("state_file", "config/vthermostat_state.json")
+    @staticmethod
+    def _load_state_file(state_file, cached_key):
+        """Parse the state file unless it matches cached_key.
+
+        Runs in a worker thread and only returns its results, the caller
+        stores them on the event loop. Returns whether state is available,
+        the state data or None when the cached data is still current, and
+        the key of the file that was read.
+        """
         state_path = Path(state_file)
 
         try:
-            if state_path.exists():
-                with open(state_path, "r") as f:
-                    state_data = json.load(f)
-                    self.state_data = {
-                        "last_ac_state": state_data.get("last_ac_state", False),
-                        "last_run": state_data.get("last_run", "Never"),
-                        "last_ac_change": state_data.get("last_ac_change", "Never"),
-                        "last_temperature": state_data.get("last_temperature", None),
-                    }
-                    logger.debug(f"Read state data: {self.state_data}")
-                    return True
-            else:
-                logger.warning(f"State file not found: {state_file}")
-                self.state_data = {
-                    "last_ac_state": False,
-                    "last_run": "Never",
-                    "last_ac_change": "Never",
-                    "last_temperature": None,
+            try:
+                state_key = (state_file, os.stat(state_path).st_mtime_ns)
+            except FileNotFoundError:
+                state_key = None
+
+            if state_key is not None:
+                # Only parse the file again once it has been rewritten
+                if state_key == cached_key:
+                    return True, None, state_key
+                with open(state_path, "rb") as f:
+                    state_data = orjson.loads(f.read())
+                state_data = {
+                    "last_ac_state": state_data.get("last_ac_state", False),
+                    "last_run": state_data.get("last_run", "Never"),
+                    "last_ac_change": state_data.get("last_ac_change", "Never"),
+                    "last_temperature": state_data.get("last_temperature", None),
                 }
-                return False
+                logger.debug("Read state data: %s", state_data)
+                return True, state_data, state_key
+            else:
+                logger.warning("State file not found: %s", state_file)
+                return False, dict(DEFAULT_STATE_DATA), None
         except Exception as e:
-            logger.error(f"Failed to read state file: {e}")
-            self.state_data = {
-                "last_ac_state": False,
-                "last_run": "Never",
-                "last_ac_change": "Never",
-                "last_temperature": None,
-            }
-            return False
+            logger.error("Failed to read state file: %s", e)
+            return False, dict(DEFAULT_STATE_DATA), None
+
+    async def _read_state_data(self):
+        """Read current state from state file in a worker thread."""
+        state_file = self.config.get("state_file", "config/vthermostat_state.json")
+        loop = asyncio.get_running_loop()
+        available, state_data, self._state_key = await loop.run_in_executor(
+            None, self._load_state_file, state_file, self._state_key
+        )
+        if state_data is not None:
+            self.state_data = state_data
+        return available
 
     async def _read_current_power(self):
         """Read power consumption data directly from smart plug."""
@@ -251,18 +345,10 @@ class SheetsLogger:
             self.current_power = 0
             return False
 
-        kasa_username = self.config.get("kasa_username")
-        kasa_password = self.config.get("kasa_password")
-
         try:
-            if kasa_username and kasa_password:
-                from kasa import Discover
-
-                plug = await Discover.discover_single(
-                    host, username=kasa_username, password=kasa_password
-                )
-            else:
-                plug = SmartPlug(host)
+            plug = await self._plug.get(
+                host, self.config.get("kasa_username"), self.config.get("kasa_password")
+            )
             await plug.update()
 
             # Check AC state and record appropriate power consumption
@@ -273,18 +359,20 @@ class SheetsLogger:
             if plug.has_emeter:
                 emeter_data = plug.emeter_realtime
                 self.current_power = emeter_data.get("power", 0)
-                logger.debug(f"Power consumption: {self.current_power:.1f}W")
+                logger.debug("Power consumption: %.1fW", self.current_power)
                 return True
             else:
                 logger.debug("Smart plug does not support power monitoring")
                 return False
         except Exception as e:
+            # Reconnect on the next cycle in case the connection went stale
+            self._plug.reset()
             if "authentication" in str(e).lower() or "login" in str(e).lower():
                 logger.error(
-                    f"Kasa authentication failed - check username/password: {e}"
+                    "Kasa authentication failed - check username/password: %s", e
                 )
             else:
-                logger.error(f"Failed to get power data from smart plug: {e}")
+                logger.error("Failed to get power data from smart plug: %s", e)
             return False
 
     def _should_upload(self, interval_minutes):
@@ -302,37 +390,24 @@ class SheetsLogger:
             return False
 
         try:
-            timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+            timestamp = time.strftime(TIMESTAMP_FORMAT)
             temperature = self.current_data.get("temperature", "")
             humidity = self.current_data.get("humidity", "")
             outside_temperature = self.current_data.get("outside_temperature", "")
-            device = self.config.get("device_name", "virtual-thermostat")
+            device = self._device
 
             # State data
             ac_state = "ON" if self.state_data.get("last_ac_state", False) else "OFF"
             last_run = self.state_data.get("last_run", "Never")
             last_ac_change = self.state_data.get("last_ac_change", "Never")
-            thermostat_enabled = "YES" if self.config.get("enabled", True) else "NO"
-            desired_temp = self.config.get("desired_temperature", "")
+            thermostat_enabled = self._thermostat_enabled
+            desired_temp = self._desired_temp
 
             # Format timestamps for better readability
             if last_run and last_run != "Never":
-                try:
-                    last_run_dt = datetime.fromisoformat(
-                        last_run.replace("Z", "+00:00")
-                    )
-                    last_run = last_run_dt.strftime("%Y/%m/%d %H:%M:%S")
-                except (ValueError, TypeError):
-                    pass  # Keep original format if parsing fails
-
+                last_run = _format_iso(last_run)
             if last_ac_change and last_ac_change != "Never":
-                try:
-                    last_ac_change_dt = datetime.fromisoformat(
-                        last_ac_change.replace("Z", "+00:00")
-                    )
-                    last_ac_change = last_ac_change_dt.strftime("%Y/%m/%d %H:%M:%S")
-                except (ValueError, TypeError):
-                    pass  # Keep original format if parsing fails
+                last_ac_change = _format_iso(last_ac_change)
 
             # Append row to the worksheet with all data including power usage
             row_data = [
@@ -348,22 +423,87 @@ class SheetsLogger:
                 desired_temp,
                 self.current_power,
             ]
-            self.worksheet.append_row(row_data)
+            self._pending_rows.append(row_data)
+            excess = len(self._pending_rows) - MAX_PENDING_ROWS
+            if excess > 0:
+                del self._pending_rows[:excess]
+                logger.warning("Dropped %d oldest pending rows", excess)
+            # The row is recorded for this interval even if the upload fails,
+            # a failed flush is retried on the next cycles
+            self.last_upload = datetime.now()
 
             logger.info(
-                f"Uploaded to Google Sheets: {timestamp}, {temperature}°C, {humidity}%, Outside: {outside_temperature}°C, AC: {ac_state}, Enabled: {thermostat_enabled}{self.current_power}"
+                "Recorded for Google Sheets: %s, %s°C, %s%%, Outside: %s°C, AC: %s, "
+                "Enabled: %s, Power: %sW",
+                timestamp,
+                temperature,
+                humidity,
+                outside_temperature,
+                ac_state,
+                thermostat_enabled,
+                self.current_power,
             )
-            self.last_upload = datetime.now()
-            return True
+            return self._flush_full_batch()
 
         except Exception as e:
-            logger.error(f"Failed to upload to Google Sheets: {e}")
+            logger.error("Failed to upload to Google Sheets: %s", e)
             return False
 
+    def _flush_full_batch(self):
+        """Upload the pending rows once a batch is complete."""
+        batch_size = self.config.get("google_sheets", {}).get("batch_size", 1)
+        if len(self._pending_rows) < batch_size:
+            return True
+        try:
+            self._flush_rows()
+            return True
+        except Exception as e:
+            logger.error(
+                "Failed to upload %d rows to Google Sheets: %s",
+                len(self._pending_rows),
+                e,
+            )
+            return False
+
+    def _flush_rows(self):
+        """Append all pending rows to the worksheet in one API call."""
+        if not self._pending_rows:
+            return
+        # RAW matches what append_row sent, and an explicit table range
+        # spares the API from detecting the table on every append
+        self.worksheet.append_rows(
+            self._pending_rows,
+            value_input_option="RAW",
+            insert_data_option="INSERT_ROWS",
+            table_range="A1",
+        )
+        logger.debug("Appended %d rows to Google Sheets", len(self._pending_rows))
+        self._pending_rows = []
+
+    async def close(self):
+        """Upload the rows still waiting for a full batch and disconnect."""
+        try:
+            self._flush_rows()
+        except Exception as e:
+            logger.error(
+                "Failed to upload %d pending rows to Google Sheets: %s",
+                len(self._pending_rows),
+                e,
+            )
+
+        if self._mqtt is not None:
+            self._mqtt.close()
+            self._mqtt = None
+
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
     async def run_once(self):
         """Single execution cycle - read data and upload if needed."""
-        with open(self.config_file, "r") as f:
-            self.config = json.load(f)
+        # Reload the config only when the file has been modified
+        if os.stat(self.config_file).st_mtime_ns != self._config_mtime:
+            self._load_config()
 
         sheets_config = self.config.get("google_sheets", {})
         if not sheets_config.get("enabled", False):
@@ -372,10 +512,13 @@ class SheetsLogger:
 
         interval_minutes = sheets_config.get("upload_interval_minutes", 15)
 
-        # Read sensor data, state data, and power data
-        sensor_data_available = self._read_sensor_data()
-        state_data_available = self._read_state_data()
-        await self._read_current_power()
+        # Read sensor, state and power data concurrently, the state file is
+        # read in a worker thread so slow storage does not stall the loop
+        sensor_data_available, state_data_available, _ = await asyncio.gather(
+            self._read_sensor_data(),
+            self._read_state_data(),
+            self._read_current_power(),
+        )
 
         if not sensor_data_available or not state_data_available:
             logger.warning("No sensor or state data available, skipping upload")
@@ -383,13 +526,16 @@ class SheetsLogger:
 
         # Check if it's time to upload
         if self._should_upload(interval_minutes):
-            logger.info(f"Uploading data (interval: {interval_minutes} minutes)")
+            logger.info("Uploading data (interval: %s minutes)", interval_minutes)
             self._upload_to_sheets()
         else:
-            next_upload = self.last_upload + timedelta(minutes=interval_minutes)
-            logger.debug(
-                f"Next upload scheduled for: {next_upload.strftime('%H:%M:%S')}"
-            )
+            # Retry rows whose upload failed on an earlier cycle
+            self._flush_full_batch()
+            if logger.isEnabledFor(logging.DEBUG):
+                next_upload = self.last_upload + timedelta(minutes=interval_minutes)
+                logger.debug(
+                    "Next upload scheduled for: %s", next_upload.strftime("%H:%M:%S")
+                )
 
     async def run_daemon(self, check_interval):
         """Run logger continuously as a daemon."""
@@ -397,22 +543,37 @@ class SheetsLogger:
         upload_interval = sheets_config.get("upload_interval_minutes", 15)
 
         logger.info("Starting Google Sheets logger daemon")
-        logger.info(f"Upload interval: {upload_interval} minutes")
-        logger.info(f"Check interval: {check_interval} seconds")
+        logger.info("Upload interval: %s minutes", upload_interval)
+        logger.info("Check interval: %s seconds", check_interval)
         logger.info(
-            f"MQTT broker: {self.config.get('mqtt', {}).get('broker', 'localhost')}"
+            "MQTT broker: %s", self.config.get("mqtt", {}).get("broker", "localhost")
         )
 
+        # Run cycles on a fixed schedule so their run time does not drift
+        # the upload cadence
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
         try:
             while True:
                 try:
                     await self.run_once()
                 except Exception as e:
-                    logger.error(f"Error in logger cycle: {e}")
-
-                await asyncio.sleep(check_interval)
+                    logger.error("Error in logger cycle: %s", e)
+
+                next_tick += check_interval
+                now = loop.time()
+                if now > next_tick:
+                    # Skip the ticks missed by a slow cycle instead of
+                    # running the next cycles back to back
+                    missed = (now - next_tick) // check_interval + 1
+                    next_tick += missed * check_interval
+                await asyncio.sleep(next_tick - now)
         except KeyboardInterrupt:
             logger.info("Stopping Google Sheets logger daemon (Ctrl+C pressed)")
+        except asyncio.CancelledError:
+            # asyncio.run cancels the daemon on Ctrl+C since Python 3.11
+            logger.info("Stopping Google Sheets logger daemon (cancelled)")
+            raise
 
 
 @click.command()
@@ -441,12 +602,18 @@ def cli_main(config, daemon, check_interval, log_level):
     if check_interval < 1:
         raise click.ClickException("Check interval must be at least 1 second")
 
-    logger = SheetsLogger(config)
+    sheets_logger = SheetsLogger(config)
+
+    async def run():
+        try:
+            if daemon:
+                await sheets_logger.run_daemon(check_interval)
+            else:
+                await sheets_logger.run_once()
+        finally:
+            await sheets_logger.close()
 
-    if daemon:
-        asyncio.run(logger.run_daemon(check_interval))
-    else:
-        asyncio.run(logger.run_once())
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
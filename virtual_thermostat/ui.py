@@ -5,16 +5,20 @@ Provides a web interface to monitor and control the thermostat state.
 """
 
 import asyncio
-import json
+import functools
 import logging
+import os
 import sys
+import tempfile
+import time
 from datetime import datetime
-from pathlib import Path
 
+import orjson
 from trame.app import get_server, asynchronous
 from trame.ui.vuetify import SinglePageWithDrawerLayout
 from trame.widgets import html, vuetify
-from kasa import SmartPlug
+
+from virtual_thermostat.connections import PlugConnection
 
 # Configure logging
 logging.basicConfig(
@@ -26,12 +30,73 @@ logger = logging.getLogger("thermostat-controller")
 DEFAULT_CONFIG_FILE = "config/vthermostat_config.json"
 DEFAULT_STATE_FILE = "config/vthermostat_state.json"
 
+# State is written compactly like the thermostat does, VTHERMOSTAT_PRETTY=1
+# indents it for debugging. The config stays indented for hand editing.
+STATE_DUMP_OPTION = (
+    orjson.OPT_INDENT_2 if os.environ.get("VTHERMOSTAT_PRETTY") == "1" else 0
+)
+
+# Types of the temperatures that can be converted for display
+NUMERIC_TYPES = (int, float)
+
+# Seconds to wait for more setting changes before writing the config file
+CONFIG_SAVE_DELAY = 0.25
+
+# Parsed JSON files keyed by path, reused while the file mtime and size are
+# unchanged
+_json_cache = {}
+
+
+def _read_json_cached(path):
+    """Read a JSON file, only parsing it again when it was modified."""
+    path = str(path)
+    st = os.stat(path)
+    # The size catches rewrites within the mtime granularity of the filesystem
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _json_cache.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, "rb") as f:
+            cached = (stamp, orjson.loads(f.read()))
+        _json_cache[path] = cached
+    # Callers update the returned dict in place, hand out a copy
+    return dict(cached[1])
+
+
+@functools.lru_cache(maxsize=2)
+def _format_clock(epoch_second):
+    """Return the local time of day of a whole second, cached per second."""
+    return time.strftime("%H:%M:%S", time.localtime(epoch_second))
+
+
+def _write_json_atomic(path, data, option=0):
+    """Write data as JSON so readers never see a partially written file."""
+    # Each write gets its own temporary file, the thermostat daemon writes
+    # the state file too
+    path = str(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}."
+    )
+    try:
+        # mkstemp creates the file private, keep the permissions of the file
+        # being replaced
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            pass
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(data, option=option))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 def save_config(config, config_file=DEFAULT_CONFIG_FILE):
     """Save configuration to file."""
     try:
-        with open(config_file, "w") as f:
-            json.dump(config, f, indent=2)
+        _write_json_atomic(config_file, config, orjson.OPT_INDENT_2)
         return True
     except IOError as e:
         logger.error(f"Error saving config: {e}")
@@ -40,30 +105,23 @@ def save_config(config, config_file=DEFAULT_CONFIG_FILE):
 
 def read_config(config_file=DEFAULT_CONFIG_FILE):
     """Read configuration from file."""
-    config_path = Path(config_file)
-    if not config_path.exists():
+    try:
+        return _read_json_cached(config_file)
+    except FileNotFoundError:
         logger.error(f"Config file {config_file} not found")
         return None
-
-    try:
-        with open(config_path, "r") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
+    except (orjson.JSONDecodeError, IOError) as e:
         logger.error(f"Error reading config: {e}")
         return None
 
 
 def load_state(state_file=DEFAULT_STATE_FILE):
     """Load state from file."""
-    state_path = Path(state_file)
-    if not state_path.exists():
-        return {"last_ac_state": False, "last_ac_change": None}
-
     try:
-        with open(state_path, "r") as f:
-            state = json.load(f)
-            return state
-    except (json.JSONDecodeError, IOError) as e:
+        return _read_json_cached(state_file)
+    except FileNotFoundError:
+        return {"last_ac_state": False, "last_ac_change": None}
+    except (orjson.JSONDecodeError, IOError) as e:
         logger.error(f"Error loading state: {e}")
         return {"last_ac_state": False, "last_ac_change": None}
 
@@ -71,14 +129,33 @@ def load_state(state_file=DEFAULT_STATE_FILE):
 def save_state(state, state_file=DEFAULT_STATE_FILE):
     """Save state to file."""
     try:
-        with open(state_file, "w") as f:
-            json.dump(state, f, indent=2)
+        _write_json_atomic(state_file, state, STATE_DUMP_OPTION)
         return True
     except IOError as e:
         logger.error(f"Error saving state: {e}")
         return False
 
 
+class SerialWriter:
+    """Run file saves in a worker thread, one at a time and in call order.
+
+    Saves of the same file must not overlap, or an older snapshot could
+    replace a newer one depending on which thread finishes last.
+    """
+
+    def __init__(self):
+        # Created on first use so it belongs to the running event loop
+        self._lock = None
+
+    async def write(self, save, data, path):
+        """Call save(data, path) once the previous saves are done."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, save, data, path)
+
+
 class ThermostatController:
     def __init__(self):
         self.server = get_server(client_type="vue2")
@@ -109,6 +186,12 @@ class ThermostatController:
             logger.error("Could not load configuration")
             sys.exit(1)
 
+        # Display unit mirrored from the state file and the UI toggle, kept
+        # here instead of reading it back from the trame state
+        self._display_fahrenheit = False
+        # Time of the last refresh from the files, published with the data
+        self._last_refresh = "Never"
+
         # Initialize server state
         self.update_server_state()
 
@@ -121,43 +204,59 @@ class ThermostatController:
         self.state.change("cooldown_minutes")(self.on_cooldown_change)
         self.state.change("auto_refresh_enabled")(self.on_auto_refresh_change)
 
+        # Pending debounced config write, see _schedule_config_save, and
+        # whether the config changed since that task last wrote it
+        self._config_save_task = None
+        self._config_dirty = False
+        # Config and state saves go through one writer so they never overlap
+        self._writer = SerialWriter()
+        # State saves started from change callbacks, referenced until done
+        self._state_save_tasks = set()
+        # Local changes made so far and file writes not finished yet, the
+        # background refresh must not replace them with older file contents
+        self._local_changes = 0
+        self._writes_pending = 0
+
+        # Smart plug connection reused across manual AC controls
+        self._plug = PlugConnection()
+
         # Start background autorefresh thread
         self.running = True
         self.auto_refresh_enabled = True
-        self._update_task = asynchronous.create_task(self.background_refresh())
+        # Kept apart from _update_task, which update_points cancels
+        self._refresh_task = asynchronous.create_task(self.background_refresh())
 
     def celsius_to_fahrenheit(self, celsius):
         """Convert Celsius to Fahrenheit."""
-        if isinstance(celsius, (int, float)):
-            return round(celsius * 9 / 5 + 32, 1)
+        if isinstance(celsius, NUMERIC_TYPES):
+            return round(celsius * 1.8 + 32, 1)
         return celsius
 
     def fahrenheit_to_celsius(self, fahrenheit):
         """Convert Fahrenheit to Celsius."""
-        if isinstance(fahrenheit, (int, float)):
+        if isinstance(fahrenheit, NUMERIC_TYPES):
             return round((fahrenheit - 32) * 5 / 9, 1)
         return fahrenheit
 
     def get_display_temp(self, celsius_temp):
         """Get temperature in display unit."""
-        display_fahrenheit = getattr(self.state, "display_fahrenheit", False)
-        if display_fahrenheit:
+        if self._display_fahrenheit:
             return self.celsius_to_fahrenheit(celsius_temp)
         return celsius_temp
 
     def get_display_unit(self):
         """Get display unit symbol."""
-        display_fahrenheit = getattr(self.state, "display_fahrenheit", False)
-        return "F" if display_fahrenheit else "C"
+        return "F" if self._display_fahrenheit else "C"
 
     def update_server_state(self):
         """Update trame server state with current thermostat data."""
         display_fahrenheit = self.current_state.get("display_fahrenheit", False)
+        self._display_fahrenheit = display_fahrenheit
         desired_temperature_c = self.config.get("desired_temperature", 24)
         last_temp = self.current_state.get("last_temperature", "Unknown")
 
         # Format temperature display
-        if isinstance(last_temp, (int, float)):
+        if isinstance(last_temp, NUMERIC_TYPES):
             last_temp_display = f"{self.get_display_temp(last_temp)}"
         else:
             last_temp_display = str(last_temp)
@@ -178,7 +277,7 @@ class ThermostatController:
                 "ac_state_text": (
                     "ON" if self.current_state.get("last_ac_state", False) else "OFF"
                 ),
-                "last_refresh": getattr(self.state, "last_refresh", "Never"),
+                "last_refresh": self._last_refresh,
                 "auto_refresh_enabled": getattr(self, "auto_refresh_enabled", True),
             }
         )
@@ -186,15 +285,12 @@ class ThermostatController:
     def on_enabled_change(self, enabled, **kwargs):
         """Handle enabled/disabled toggle."""
         self.config["enabled"] = enabled
-        if self.save_config():
-            logger.info(f"Thermostat {'enabled' if enabled else 'disabled'}")
-        else:
-            logger.error("Failed to save config")
+        self._schedule_config_save()
+        logger.info(f"Thermostat {'enabled' if enabled else 'disabled'}")
 
     def on_desired_temperature_change(self, desired_temperature_display, **kwargs):
         """Handle desired temperature change (convert from display unit to Celsius)."""
-        display_fahrenheit = getattr(self.state, "display_fahrenheit", False)
-        if display_fahrenheit:
+        if self._display_fahrenheit:
             desired_temperature_c = self.fahrenheit_to_celsius(
                 desired_temperature_display
             )
@@ -202,17 +298,16 @@ class ThermostatController:
             desired_temperature_c = desired_temperature_display
 
         self.config["desired_temperature"] = desired_temperature_c
-        if self.save_config():
-            logger.info(
-                f"Desired temperature set to {desired_temperature_c}°C "
-                f"({desired_temperature_display}°{self.get_display_unit()})"
-            )
-        else:
-            logger.error("Failed to save config")
+        self._schedule_config_save()
+        logger.info(
+            f"Desired temperature set to {desired_temperature_c}°C "
+            f"({desired_temperature_display}°{self.get_display_unit()})"
+        )
 
     def on_display_unit_change(self, display_fahrenheit, **kwargs):
         """Handle display unit toggle change."""
         self.current_state["display_fahrenheit"] = display_fahrenheit
+        self._display_fahrenheit = display_fahrenheit
 
         # Update display temperatures and unit
         desired_temperature_c = self.config.get("desired_temperature", 24)
@@ -223,22 +318,18 @@ class ThermostatController:
 
         # Update current temperature display if it's a numeric value
         last_temp = self.current_state.get("last_temperature")
-        if isinstance(last_temp, (int, float)):
+        if isinstance(last_temp, NUMERIC_TYPES):
             self.state.last_temperature = f"{self.get_display_temp(last_temp)}"
 
-        if save_state(self.current_state, self.state_file):
-            unit = "Fahrenheit" if display_fahrenheit else "Celsius"
-            logger.info(f"Display unit changed to {unit}")
-        else:
-            logger.error("Failed to save state")
+        self._schedule_state_save()
+        unit = "Fahrenheit" if display_fahrenheit else "Celsius"
+        logger.info(f"Display unit changed to {unit}")
 
     def on_cooldown_change(self, cooldown_minutes, **kwargs):
         """Handle cooldown time change."""
         self.config["cooldown_minutes"] = cooldown_minutes
-        if self.save_config():
-            logger.info(f"Cooldown time set to {cooldown_minutes} minutes")
-        else:
-            logger.error("Failed to save config")
+        self._schedule_config_save()
+        logger.info(f"Cooldown time set to {cooldown_minutes} minutes")
 
     def on_auto_refresh_change(self, auto_refresh_enabled, **kwargs):
         """Handle auto refresh toggle change."""
@@ -249,6 +340,64 @@ class ThermostatController:
         """Save current config to file."""
         return save_config(self.config, self.config_file)
 
+    def _schedule_config_save(self):
+        """Write the config shortly, coalescing changes made in the meantime.
+
+        Dragging a slider fires many change events, they end up in one write.
+        """
+        self._local_changes += 1
+        self._config_dirty = True
+        if self._config_save_task is None:
+            self._writes_pending += 1
+            self._config_save_task = asynchronous.create_task(self._save_config_later())
+
+    async def _save_config_later(self):
+        """Wait for further setting changes, then write the config.
+
+        Changes made while the file is being written are saved again by
+        the same task, so only one config write is in flight at a time.
+        """
+        try:
+            while self._config_dirty:
+                await asyncio.sleep(CONFIG_SAVE_DELAY)
+                self._config_dirty = False
+                # Write a snapshot in a worker thread so the server stays
+                # responsive
+                saved = await self._writer.write(
+                    save_config, dict(self.config), self.config_file
+                )
+                if not saved:
+                    logger.error("Failed to save config")
+        finally:
+            self._config_save_task = None
+            self._writes_pending -= 1
+
+    def _schedule_state_save(self):
+        """Save the state in the background from a change callback."""
+        task = asynchronous.create_task(self._save_state())
+        self._state_save_tasks.add(task)
+        task.add_done_callback(self._on_state_save_done)
+
+    def _on_state_save_done(self, task):
+        """Forget a finished background state save and report its failure."""
+        self._state_save_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error saving state: {task.exception()}")
+
+    async def _save_state(self):
+        """Write the current state to file in a worker thread."""
+        self._local_changes += 1
+        self._writes_pending += 1
+        try:
+            saved = await self._writer.write(
+                save_state, dict(self.current_state), self.state_file
+            )
+            if not saved:
+                logger.error("Failed to save state")
+            return saved
+        finally:
+            self._writes_pending -= 1
+
     async def control_ac(self, turn_on):
         """Control the AC via smart plug."""
         host = self.config.get("host")
@@ -256,18 +405,10 @@ class ThermostatController:
             logger.error("No host configured for smart plug")
             return False
 
-        kasa_username = self.config.get("kasa_username")
-        kasa_password = self.config.get("kasa_password")
-
         try:
-            if kasa_username and kasa_password:
-                from kasa import Discover
-
-                plug = await Discover.discover_single(
-                    host, username=kasa_username, password=kasa_password
-                )
-            else:
-                plug = SmartPlug(host)
+            plug = await self._plug.get(
+                host, self.config.get("kasa_username"), self.config.get("kasa_password")
+            )
             await plug.update()
 
             current_state = plug.is_on
@@ -285,7 +426,7 @@ class ThermostatController:
             # Update state
             self.current_state["last_ac_state"] = turn_on
             self.current_state["last_ac_change"] = datetime.now().isoformat()
-            save_state(self.current_state, self.state_file)
+            await self._save_state()
 
             # Update UI state
             with self.state:
@@ -294,6 +435,8 @@ class ThermostatController:
 
             return turn_on
         except Exception as e:
+            # Connect again on the next manual control
+            self._plug.reset()
             if "authentication" in str(e).lower() or "login" in str(e).lower():
                 logger.error(
                     f"Kasa authentication failed - check username/password: {e}"
@@ -330,27 +473,50 @@ class ThermostatController:
             self._update_task.cancel()
         self._update_task = asynchronous.create_task(self._update_points())
 
+    def _read_files(self):
+        """Read the state and config files, safe to run in a worker thread."""
+        return load_state(self.state_file), read_config(self.config_file)
+
+    def _apply_data(self, current_state, config):
+        """Show freshly read state and config, keeping the last good config."""
+        self.current_state = current_state
+        if config is not None:
+            self.config = config
+        self._last_refresh = _format_clock(int(time.time()))
+        self.update_server_state()
+
     def refresh_data(self):
         """Refresh data from state file."""
-        self.current_state = load_state(self.state_file)
-        self.config = read_config(self.config_file)
-        self.update_server_state()
-        self.state.last_refresh = datetime.now().strftime("%H:%M:%S")
+        self._apply_data(*self._read_files())
         logger.debug("Manual data refresh completed")
 
+    async def _refresh_from_files(self, loop):
+        """Read both files off the event loop and publish them at once."""
+        # The files would show previous values while local changes are
+        # still being written, or if a setting changed during the read
+        if self._writes_pending:
+            return
+        changes = self._local_changes
+        data = await loop.run_in_executor(None, self._read_files)
+        if changes != self._local_changes:
+            return
+
+        with self.state:
+            self._apply_data(*data)
+
+        # Don't lock server before enabling the spinner on client
+        await self.server.network_completion
+        logger.debug("Background auto-refresh executed")
+
     async def background_refresh(self):
         """Background thread for auto-refresh."""
         # Initial delay
         await asyncio.sleep(1)
+        loop = asyncio.get_running_loop()
         while self.running:
             try:
                 if self.auto_refresh_enabled:
-                    with self.state:
-                        self.refresh_data()
-
-                    # Don't lock server before enabling the spinner on client
-                    await self.server.network_completion
-                    logger.debug("Background auto-refresh executed")
+                    await self._refresh_from_files(loop)
             except Exception as e:
                 logger.error(f"Error in background refresh: {e}")
             await asyncio.sleep(5)  # Refresh every 5 seconds